@@ -1,8 +1,64 @@
+import importlib
+
 __all__ = [
     "extended_tables_extension",
     "header_extensions",
     "highlight_extensions",
     "ps2_buttons_extension",
     "small_image_extension",
-    "inline_extensions"
+    "inline_extensions",
+    "trigger_prescan_extension",
+    "compact_output_extension",
+    "rendering",
+    "render_cache",
+    "incremental_rendering",
+    "parallel_rendering",
+    "async_rendering",
+    "watch",
+    "thumbnails",
+    "image_manifest",
+    "sharded_output",
+    "benchmarks",
+    "instrumentation"
 ]
+
+# The extensions by name, as (module, class), so one can be created without importing the modules of the others
+# They can also be named with a "kdlf." in front (eg: "kdlf.extended_tables")
+EXTENSIONS = {
+    "extended_tables": ("extended_tables_extension", "ExtendedTableExtension"),
+    "add_blanks_around_headers": ("header_extensions", "AddBlanksAroundHeadersExtension"),
+    "sections_via_headers": ("header_extensions", "SectionsViaHeadersExtension"),
+    "ps2_buttons": ("ps2_buttons_extension", "PS2ButtonsExtension"),
+    "small_image": ("small_image_extension", "SmallImageExtension"),
+    "link_blank": ("inline_extensions", "LinkBlankInlineExtension"),
+    "warning_highlight": ("highlight_extensions", "WarningHighlightExtension"),
+    "text_highlight": ("highlight_extensions", "TextHighlightExtension"),
+    "unsure_highlight": ("highlight_extensions", "UnsureHighlightExtension"),
+    "trigger_prescan": ("trigger_prescan_extension", "TriggerPrescanExtension"),
+    "instrumentation": ("instrumentation", "InstrumentationExtension"),
+    "sharded_sections": ("sharded_output", "ShardedSectionsExtension"),
+    "compact_output": ("compact_output_extension", "CompactOutputExtension"),
+}
+_PREFIX = "kdlf."
+
+
+def extension_name(name: str) -> str:
+    """ Get the name in EXTENSIONS of an extension (without the "kdlf." in front), or name itself if it's not one of them """
+    if name.startswith(_PREFIX) and name[len(_PREFIX):] in EXTENSIONS:
+        return name[len(_PREFIX):]
+    return name
+
+
+def get_extension(name: str, **kwargs):
+    """ Create the extension called name in EXTENSIONS (with or without "kdlf." in front), with kwargs as its config
+    Only the module of that extension is imported """
+    module_name, class_name = EXTENSIONS[extension_name(name)]
+    module = importlib.import_module(f".{module_name}", __name__)
+    return getattr(module, class_name)(**kwargs)
+
+
+def __getattr__(name: str):
+    # Modules are only imported the first time they're used (eg: package.header_extensions)
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,137 @@
+from typing import Iterable
+import asyncio
+import json
+import os
+import weakref
+
+from . import extension_name
+from .rendering import DEFAULT_EXTENSIONS, Renderer
+
+
+class AsyncRenderer:
+    """Renders documents for asyncio code, in threads, so the event loop isn't stalled while they're converted
+    At most max_concurrency documents are rendered at once (the others wait for their turn, without blocking the loop),
+    each by one of a pool of Renderers that are created the first time they're needed and reused after that
+
+    Requests for a document that's already being rendered wait for that render instead of starting another one
+    A request can be cancelled like any other task: the render itself is only cancelled if nobody else is waiting for it
+    (once it's started in a thread it runs to the end anyway, but its result is thrown away)
+
+    The threads are stopped by close() (or when used with async with)"""
+    def __init__(self, extensions: Iterable[str] = DEFAULT_EXTENSIONS, extension_configs: dict[str, dict] | None = None,
+                 max_concurrency: int | None = None, **kwargs):
+        self.extensions = tuple(map(extension_name, extensions))
+        self.extension_configs = {extension_name(name): config for name, config in (extension_configs or {}).items()}
+        self.kwargs = kwargs
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._renderers = [] # The ones not being used, at most max_concurrency
+        self._in_flight = {} # {text: [task rendering it, number of requests waiting for it]}
+        self._executor = None
+
+        self.renders = 0
+        self.coalesced = 0 # Requests that waited for a render that had already been started
+
+    async def render(self, text: str) -> str:
+        in_flight = self._in_flight.get(text)
+        if in_flight is None:
+            task = asyncio.ensure_future(self._render(text))
+            in_flight = self._in_flight[text] = [task, 0]
+            task.add_done_callback(lambda _: self._in_flight.pop(text, None))
+        else:
+            self.coalesced += 1
+        task = in_flight[0]
+        in_flight[1] += 1
+        try:
+            # Shielded, so cancelling one of the requests doesn't cancel the render for the others
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if in_flight[1] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            in_flight[1] -= 1
+
+    async def _render(self, text: str) -> str:
+        await self._semaphore.acquire()
+        try:
+            if self._executor is None:
+                # Only imported here, since it takes longer to import than the rest of the package
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="kdlf-async-render")
+            future = self._executor.submit(self._render_in_thread, text)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        # Released when the thread is done, not when the request is cancelled, so there are never more than
+        # max_concurrency renders going on
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._semaphore.release))
+        self.renders += 1
+        return await asyncio.wrap_future(future)
+
+    def _render_in_thread(self, text: str) -> str:
+        try:
+            renderer = self._renderers.pop()
+        except IndexError:
+            renderer = Renderer(self.extensions, self.extension_configs, **self.kwargs)
+        try:
+            return renderer.render(text)
+        finally:
+            if self._executor is None:
+                # Closed while it was rendering
+                renderer.close()
+            else:
+                self._renderers.append(renderer)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        # The ones still rendering are closed once they're done (see _render_in_thread)
+        renderers, self._renderers = self._renderers, []
+        for renderer in renderers:
+            renderer.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+# The AsyncRenderers used by render_async, for each event loop and configuration (and what closes them, see _close_with_loop)
+_shared_renderers = weakref.WeakKeyDictionary()
+
+async def _close_with_loop(renderers: dict[str, AsyncRenderer]):
+    """ Async generator that's started once and never resumed: asyncio.run (and asyncio.Runner) close the ones that are
+    left right before closing the loop (see loop.shutdown_asyncgens), which is the only way to know it's being closed """
+    loop = asyncio.get_running_loop()
+    try:
+        yield
+    finally:
+        for renderer in renderers.values():
+            renderer.close()
+        renderers.clear()
+        _shared_renderers.pop(loop, None)
+
+async def render_async(text: str, extensions: Iterable[str] = DEFAULT_EXTENSIONS,
+                       extension_configs: dict[str, dict] | None = None, **kwargs) -> str:
+    """ Convert text to HTML without blocking the event loop, with an AsyncRenderer shared by all the calls with the same
+    extensions, configs and keyword arguments (made the first time they're used in the running loop)
+    They're closed when the loop is shut down by asyncio.run or asyncio.Runner, loops closed some other way should use
+    their own AsyncRenderer instead """
+    extensions = tuple(map(extension_name, extensions))
+    key = json.dumps([extensions, extension_configs or {}, kwargs], sort_keys=True, default=repr)
+    loop = asyncio.get_running_loop()
+    if loop not in _shared_renderers:
+        renderers = {}
+        closer = _close_with_loop(renderers)
+        # Started here, so the loop knows about it
+        await closer.__anext__()
+        _shared_renderers[loop] = (renderers, closer)
+    renderers = _shared_renderers[loop][0]
+    renderer = renderers.get(key)
+    if renderer is None:
+        renderer = renderers[key] = AsyncRenderer(extensions, extension_configs, **kwargs)
+    return await renderer.render(text)
@@ -0,0 +1,13 @@
+"""Benchmarks for the kdlf extensions, on documents generated with a fixed seed
+
+Run with python -m <package>.benchmarks (see --help), to get the time and peak memory of each extension,
+how the time scales with the size of the document, and how long the modules take to import
+Use --save to store the results as a JSON baseline, and --compare to fail if something got slower than in a baseline
+python -m <package>.benchmarks.stress checks that rendering from many threads at once gives the same HTML as one at a time,
+and python -m <package>.benchmarks.latency gets the latency percentiles of render_async under load"""
+__all__ = [
+    "corpus",
+    "runner",
+    "stress",
+    "latency",
+]
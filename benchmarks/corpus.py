@@ -0,0 +1,109 @@
+from random import Random
+
+# Syntaxes that can be put in the generated paragraphs, as functions of the random generator
+_WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "do", "eiusmod", "tempor")
+_BUTTONS = ("t", "q", "x", "o", "du", "dl", "dd", "dr", "l1", "l2", "l3", "r1", "r2", "r3", "st", "se")
+_INLINE = (
+    lambda r: "@" * r.choice((2, 3)) + r.choice(_BUTTONS),
+    lambda r: f"*{r.randint(1, 5)}!{_words(r, 3)}!*",
+    lambda r: f"*!{_words(r, 3)}!*",
+    lambda r: f"*?{_words(r, 3)}?*",
+    lambda r: f"?[{_words(r, 2)}](https://example.com/{r.choice(_WORDS)})",
+    lambda r: f"!![{_words(r, 2)}](img/{r.choice(_WORDS)}.png)",
+)
+_CLASSES = ("center", "wide", "note", "dim")
+
+def _words(r: Random, count: int) -> str:
+    return " ".join(r.choice(_WORDS) for _ in range(r.randint(1, count)))
+
+
+def inline_paragraphs(r: Random, count: int, density: float = 0.5) -> str:
+    """ Paragraphs where about density of the words are kdlf inline syntaxes """
+    paragraphs = []
+    for _ in range(count):
+        words = [r.choice(_INLINE)(r) if r.random() < density else r.choice(_WORDS) for _ in range(r.randint(10, 40))]
+        paragraphs.append(" ".join(words))
+    return "\n\n".join(paragraphs)
+
+
+def table(r: Random, rows: int, columns: int) -> str:
+    """ A table for ExtendedTableExtension, with random cell options (classes, highlights, colspans and rowspans)
+    The spans never overlap or go past the edges, so the table is always valid """
+    lines = ["|" + "|".join(f"Column {i + 1}" for i in range(columns)) + "|", "|" + "|".join("---" for _ in range(columns)) + "|"]
+    rowspans = [0] * columns # Same bookkeeping as ExtendedTableProcessor
+    colspans = [1] * columns
+    for row in range(rows):
+        cells = []
+        row_options = []
+        i = 0
+        while i < columns:
+            if rowspans[i]:
+                cells.append("")
+                rowspans[i] -= 1
+                i += colspans[i]
+                continue
+            options = list(row_options)
+            row_options = [] # Row options only need to be on one cell
+            if r.random() < 0.1:
+                row_options = [f"+.{r.choice(_CLASSES)}"] if r.random() < 0.5 else [f"+!{r.randint(1, 3)}"]
+            if r.random() < 0.3:
+                options.append(f".{r.choice(_CLASSES)}")
+            if r.random() < 0.2:
+                options.append(f"!{r.randint(1, 3)}")
+            colspan = 1
+            if r.random() < 0.15:
+                # Only over the columns that aren't covered by a rowspan
+                free = 1
+                while i + free < columns and not rowspans[i + free] and free < 4:
+                    free += 1
+                colspan = r.randint(1, free)
+            rowspan = 1
+            if r.random() < 0.1:
+                rowspan = r.randint(1, min(4, rows - row))
+            if colspan > 1:
+                options.append(f">{colspan}")
+            if rowspan > 1:
+                options.append(f"^{rowspan}")
+            r.shuffle(options)
+            spec = "!{" + " ".join(options) + "}" if options else ""
+            cells.append(spec + _words(r, 3))
+            rowspans[i] = rowspan - 1
+            colspans[i] = colspan
+            i += colspan
+        lines.append("|" + "|".join(cells) + "|")
+    return "\n".join(lines)
+
+
+def header_tree(r: Random, sections: int, max_depth: int = 6) -> str:
+    """ Nested sections for SectionsViaHeadersExtension, with the headers sometimes not separated by blank lines
+    (for AddBlanksAroundHeadersExtension) """
+    parts = []
+    level = 1
+    for _ in range(sections):
+        level = max(1, min(max_depth, level + r.choice((-2, -1, 0, 1, 1))))
+        separator = "\n\n" if r.random() < 0.5 else "\n"
+        parts.append("#" * level + " " + _words(r, 4) + separator + _words(r, 30))
+    return "\n\n".join(parts)
+
+
+KINDS = ("tables", "headers", "inline", "mixed")
+
+def generate(kind: str, size: int = 1, seed: int = 0) -> str:
+    """ Generate a document of the given kind (one of KINDS), the same for the same size and seed
+    size scales the document linearly """
+    r = Random(f"{kind}-{size}-{seed}")
+    if kind == "tables":
+        return "\n\n".join(table(r, 50, 8) for _ in range(size))
+    if kind == "headers":
+        return header_tree(r, 100 * size)
+    if kind == "inline":
+        return inline_paragraphs(r, 50 * size)
+    if kind == "mixed":
+        parts = []
+        for _ in range(10 * size):
+            parts.append(header_tree(r, 5))
+            parts.append(inline_paragraphs(r, 3))
+            if r.random() < 0.3:
+                parts.append(table(r, 10, 5))
+        return "\n\n".join(parts)
+    raise ValueError(f"Unknown kind of document: {kind}")
@@ -0,0 +1,92 @@
+from random import Random
+import argparse
+import asyncio
+import sys
+import time
+
+from ..async_rendering import AsyncRenderer
+from ..rendering import DEFAULT_EXTENSIONS
+from .corpus import KINDS, generate
+
+PERCENTILES = (50, 90, 99, 100)
+TICK = 0.01 # How often the event loop is checked for stalls, in seconds
+
+
+def percentile(values: list[float], p: float) -> float:
+    """ Nearest rank percentile of values (p=100 is the maximum) """
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))]
+
+
+async def measure_latency(requests: int = 200, clients: int = 16, size: int = 1, seed: int = 0, repeated: float = 0.25,
+                          max_concurrency: int | None = None) -> dict:
+    """ Send requests to an AsyncRenderer from clients tasks at once, and get the latency of the requests, and how late
+    the event loop was to wake up a task sleeping for TICK seconds (which is what other requests would see)
+    About repeated of the requests are for one of a few documents, to show how much coalescing helps """
+    r = Random(seed)
+    hot = [generate(KINDS[i % len(KINDS)], size, seed + i) for i in range(4)]
+    texts = [r.choice(hot) if r.random() < repeated else generate(r.choice(KINDS), size, seed + 4 + i)
+             for i in range(requests)]
+    queue = asyncio.Queue()
+    for text in texts:
+        queue.put_nowait(text)
+
+    latencies = []
+    async def _client():
+        while not queue.empty():
+            text = queue.get_nowait()
+            start = time.perf_counter()
+            await renderer.render(text)
+            latencies.append(time.perf_counter() - start)
+
+    lags = []
+    async def _ticker():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    async with AsyncRenderer(DEFAULT_EXTENSIONS, max_concurrency=max_concurrency) as renderer:
+        ticker = asyncio.ensure_future(_ticker())
+        start = time.perf_counter()
+        await asyncio.gather(*(_client() for _ in range(clients)))
+        seconds = time.perf_counter() - start
+        ticker.cancel()
+    return {
+        "requests": requests,
+        "seconds": seconds,
+        "requests_per_second": requests / seconds,
+        "renders": renderer.renders,
+        "coalesced": renderer.coalesced,
+        "latency": {p: percentile(latencies, p) for p in PERCENTILES},
+        "loop_lag": {p: percentile(lags, p) for p in PERCENTILES},
+    }
+
+
+def format_report(result: dict) -> str:
+    lines = [f"{result['requests']} requests in {result['seconds']:.3f}s ({result['requests_per_second']:.1f}/s), "
+             f"{result['renders']} renders, {result['coalesced']} coalesced"]
+    for name in ("latency", "loop_lag"):
+        lines.append(f"{name:<8}" + "".join(f"  p{p}: {seconds * 1000:8.2f}ms" for p, seconds in result[name].items()))
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure the latency of render_async under load")
+    parser.add_argument("--requests", type=int, default=200, help="Number of requests")
+    parser.add_argument("--clients", type=int, default=16, help="Number of requests sent at once")
+    parser.add_argument("--size", type=int, default=1, help="Size of the generated documents")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated documents")
+    parser.add_argument("--repeated", type=float, default=0.25, help="Fraction of the requests for the same few documents")
+    parser.add_argument("--max-concurrency", type=int, help="Number of documents rendered at once (default: CPUs)")
+    args = parser.parse_args(argv)
+    result = asyncio.run(measure_latency(args.requests, args.clients, args.size, args.seed, args.repeated,
+                                         args.max_concurrency))
+    print(format_report(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+from typing import Iterable
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import markdown
+
+from ..rendering import DEFAULT_EXTENSIONS, Renderer
+from .corpus import generate
+
+# What to render for each benchmark: the extensions, and the kind of document (see corpus.KINDS)
+# Each kdlf extension is measured on its own, on the documents that use its syntax
+SCENARIOS = {
+    "extended_tables": (("extended_tables",), "tables"),
+    "add_blanks_around_headers": (("add_blanks_around_headers",), "headers"),
+    "sections_via_headers": (("add_blanks_around_headers", "sections_via_headers"), "headers"),
+    "ps2_buttons": (("ps2_buttons",), "inline"),
+    "small_image": (("small_image",), "inline"),
+    "link_blank": (("link_blank",), "inline"),
+    "warning_highlight": (("warning_highlight",), "inline"),
+    "text_highlight": (("text_highlight",), "inline"),
+    "unsure_highlight": (("unsure_highlight",), "inline"),
+    "all": (DEFAULT_EXTENSIONS, "mixed"),
+    "all_with_trigger_prescan": (DEFAULT_EXTENSIONS + ("trigger_prescan",), "mixed"),
+}
+# Extensions to use as a reference on each kind of document, the time of the scenarios is also reported without it
+_STOCK = {"tables": ("tables",)}
+
+SCALING_SIZES = (1, 2, 4, 8)
+# Modules to measure the import time of, in a new interpreter each time ("" is the package itself)
+# markdown is there to compare with, since all the others import it
+IMPORTS = ("markdown", "", "extended_tables_extension", "header_extensions", "ps2_buttons_extension", "rendering")
+_PACKAGE = __name__.rsplit(".", 2)[0]
+METRICS = ("seconds", "peak_bytes")
+
+
+def measure(extensions: Iterable[str], text: str, repeat: int = 5) -> dict[str, float]:
+    """ Render text with the given extensions, and get the best time out of repeat runs, and the peak memory used
+    The Markdown instance is created (and used once) before measuring, so only the rendering counts """
+    renderer = Renderer(extensions)
+    renderer.render(text)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        renderer.render(text)
+        best = min(best, time.perf_counter() - start)
+
+    # Measured separately, since tracing slows everything down
+    tracemalloc.start()
+    try:
+        renderer.render(text)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def measure_import(module: str, repeat: int = 5) -> dict[str, float]:
+    """ Get the best time out of repeat runs to import module (a module of this package, "" for the package itself,
+    or "markdown") in a new interpreter """
+    if module != "markdown":
+        module = f"{_PACKAGE}.{module}" if module else _PACKAGE
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    best = float("inf")
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True, text=True).stdout
+        best = min(best, float(output))
+    return {"seconds": best}
+
+
+def run_benchmarks(size: int = 1, repeat: int = 5, seed: int = 0, scenarios: Iterable[str] | None = None,
+                   scaling: bool = True, imports: bool = True) -> dict:
+    """ Run the scenarios (all of them by default), and get the results as a dict that can be saved as JSON
+    For each scenario, "overhead_seconds" is the time minus the one of stock Markdown on the same document
+    If scaling is True, the "all" scenario is also run on documents of each size in SCALING_SIZES (times size)
+    If imports is True, the time to import each of IMPORTS is measured too """
+    documents = {}
+    def _document(kind: str, document_size: int) -> str:
+        if (kind, document_size) not in documents:
+            documents[kind, document_size] = generate(kind, document_size, seed)
+        return documents[kind, document_size]
+
+    stock = {}
+    results = {}
+    for name in scenarios or SCENARIOS:
+        extensions, kind = SCENARIOS[name]
+        text = _document(kind, size)
+        if kind not in stock:
+            stock[kind] = measure(_STOCK.get(kind, ()), text, repeat)
+        result = measure(extensions, text, repeat)
+        result["overhead_seconds"] = result["seconds"] - stock[kind]["seconds"]
+        result["bytes"] = len(text.encode("utf-8"))
+        results[name] = result
+
+    report = {
+        "info": {
+            "python": platform.python_version(),
+            "markdown": markdown.__version__,
+            "platform": platform.platform(),
+            "size": size,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "stock": stock,
+        "scenarios": results,
+    }
+    if scaling:
+        extensions, kind = SCENARIOS["all"]
+        report["scaling"] = {str(size * factor): measure(extensions, _document(kind, size * factor), repeat)
+                             for factor in SCALING_SIZES}
+    if imports:
+        report["imports"] = {module or _PACKAGE: measure_import(module, repeat) for module in IMPORTS}
+    return report
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> list[str]:
+    """ Get a description of every metric of current that's worse than in baseline by more than threshold
+    (eg: 0.1 means 10% slower, or using 10% more memory) """
+    regressions = []
+    for section in ("scenarios", "scaling", "imports"):
+        for name, old in baseline.get(section, {}).items():
+            new = current.get(section, {}).get(name)
+            if new is None:
+                continue
+            for metric in METRICS:
+                if old.get(metric) and new.get(metric, 0) > old[metric] * (1 + threshold):
+                    regressions.append(f"{section}/{name} {metric}: {old[metric]:.6g} -> {new[metric]:.6g} "
+                                       f"(+{(new[metric] / old[metric] - 1) * 100:.1f}%)")
+    return regressions
+
+
+def format_report(report: dict) -> str:
+    lines = [f"{'scenario':<28}{'ms':>10}{'overhead ms':>14}{'peak KiB':>12}"]
+    for name, result in report["scenarios"].items():
+        lines.append(f"{name:<28}{result['seconds'] * 1000:>10.2f}{result['overhead_seconds'] * 1000:>14.2f}"
+                     f"{result['peak_bytes'] / 1024:>12.0f}")
+    if "scaling" in report:
+        lines.append("")
+        lines.append(f"{'size':<28}{'ms':>10}{'ms/size':>14}{'peak KiB':>12}")
+        for size, result in report["scaling"].items():
+            lines.append(f"{size:<28}{result['seconds'] * 1000:>10.2f}{result['seconds'] * 1000 / int(size):>14.2f}"
+                         f"{result['peak_bytes'] / 1024:>12.0f}")
+    if "imports" in report:
+        lines.append("")
+        lines.append(f"{'import':<28}{'ms':>10}")
+        for module, result in report["imports"].items():
+            lines.append(f"{module:<28}{result['seconds'] * 1000:>10.2f}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the kdlf extensions on generated documents")
+    parser.add_argument("--size", type=int, default=1, help="Size of the generated documents")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs to take the best time from")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated documents")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Only run this scenario (can be repeated)")
+    parser.add_argument("--no-scaling", action="store_true", help="Don't run the scaling benchmark")
+    parser.add_argument("--no-imports", action="store_true", help="Don't measure the import times")
+    parser.add_argument("--save", metavar="PATH", help="Save the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="Compare the results with a JSON baseline, and fail on regressions")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Fraction a metric can get worse by before it's a regression (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.size, args.repeat, args.seed, args.scenario, not args.no_scaling, not args.no_imports)
+    print(format_report(report))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print("\nRegressions:", *regressions, sep="\n", file=sys.stderr)
+            return 1
+        print("\nNo regressions")
+    return 0
@@ -0,0 +1,61 @@
+from typing import Iterable
+import argparse
+import sys
+import time
+
+from ..rendering import DEFAULT_EXTENSIONS, ConcurrentRenderer, Renderer
+from .corpus import KINDS, generate
+
+# Configurations to check, so the large table mode and the memoized cells are rendered from many threads too
+CONFIGS = {
+    "default": {},
+    "large_tables": {"extended_tables": {"large_table_cells": 64, "memoize_cells": True, "cell_cache_size": 256}},
+}
+
+
+def check_concurrent(documents: int = 200, size: int = 1, seed: int = 0, workers: int = 8,
+                     extensions: Iterable[str] = DEFAULT_EXTENSIONS + ("trigger_prescan",),
+                     extension_configs: dict[str, dict] | None = None) -> tuple[list[int], float, float]:
+    """ Render generated documents one after the other, and then with a ConcurrentRenderer of workers threads
+    Returns the indexes of the documents whose HTML was different, and the time each of the two took """
+    texts = [generate(KINDS[i % len(KINDS)], size, seed + i) for i in range(documents)]
+    renderer = Renderer(extensions, extension_configs)
+    start = time.perf_counter()
+    serial = [renderer.render(text) for text in texts]
+    serial_seconds = time.perf_counter() - start
+
+    with ConcurrentRenderer(extensions, extension_configs, workers) as concurrent_renderer:
+        start = time.perf_counter()
+        concurrent = list(concurrent_renderer.render_many(texts))
+        concurrent_seconds = time.perf_counter() - start
+    return [i for i, (a, b) in enumerate(zip(serial, concurrent)) if a != b], serial_seconds, concurrent_seconds
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Check that rendering from many threads gives the same HTML as one at a time")
+    parser.add_argument("--documents", type=int, default=200, help="Number of documents to render")
+    parser.add_argument("--size", type=int, default=1, help="Size of the generated documents")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first document")
+    parser.add_argument("--workers", type=int, default=8, help="Number of threads")
+    args = parser.parse_args(argv)
+
+    failed = False
+    # Switch threads much more often than usual, so races are more likely to show up
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for name, extension_configs in CONFIGS.items():
+            mismatches, serial_seconds, concurrent_seconds = check_concurrent(args.documents, args.size, args.seed,
+                                                                             args.workers, extension_configs=extension_configs)
+            print(f"{name}: {len(mismatches)} of {args.documents} documents differ "
+                  f"(serial {serial_seconds:.3f}s, {args.workers} threads {concurrent_seconds:.3f}s)")
+            if mismatches:
+                print("  Seeds:", *(args.seed + i for i in mismatches[:20]), file=sys.stderr)
+                failed = True
+    finally:
+        sys.setswitchinterval(switch_interval)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
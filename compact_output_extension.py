@@ -0,0 +1,125 @@
+from markdown.extensions import Extension
+from markdown.postprocessors import Postprocessor
+from markdown.preprocessors import Preprocessor
+from markdown import Markdown
+import re
+
+# Whitespace as HTML sees it, only these ASCII characters (\s would also match eg: a non-breaking space, which is text)
+_SPACE = r'[ \t\n\f\r]'
+_RE_SPACES = re.compile(_SPACE + '+')
+
+# Tags whose content is left exactly as it is (whitespace matters in there, and scripts can have anything in them)
+_RE_VERBATIM = re.compile(rf'<(pre|script|style|textarea)\b.*?</\1{_SPACE}*>', re.DOTALL | re.IGNORECASE)
+
+# An attribute, with its value if it has one (quoted values are taken whole, so they're never read as attributes)
+_ATTRIBUTE = rf'''[^ \t\n\f\r"'<>/=]+(?:{_SPACE}*={_SPACE}*(?:"[^"]*"|'[^']*'|[^ \t\n\f\r"'=<>`]+))?'''
+# Every tag, with the whitespace after it (and comments, so the tags in them are left alone)
+# Raw HTML goes through here too, so what looks like a tag or a class=" can be in the value of another attribute:
+# every tag is matched as a whole, so they're never looked at
+_RE_TAG = re.compile(rf'''<!--.*?-->|<(/?)([a-zA-Z][^ \t\n\f\r/<>]*)((?:{_SPACE}+{_ATTRIBUTE})*{_SPACE}*/?)>({_SPACE}*)''',
+                     re.DOTALL)
+# Any attribute of a tag, groups 1 to 3 are the name, quote and value of the quoted class and rel ones
+_RE_TOKEN_ATTRIBUTE = re.compile(rf'''{_SPACE}+(?:(class|rel){_SPACE}*={_SPACE}*(["'])(.*?)\2|{_ATTRIBUTE})''',
+                                 re.IGNORECASE | re.DOTALL)
+
+# Tables and sections, the whitespace between their tags isn't shown by browsers anyway
+_STRUCTURE_TAGS = {"table", "thead", "tbody", "tfoot", "tr", "th", "td", "caption", "colgroup", "col", "section"}
+_RE_STRUCTURE_TAG = re.compile(rf'</?(?:{"|".join(_STRUCTURE_TAGS)})[ \t\n\f\r/>]', re.IGNORECASE)
+
+
+def _compact_attribute(m: re.Match[str]) -> str:
+    if m.group(1) is None:
+        return m.group()
+    # Repeated tokens only count once, and an attribute with none is the same as no attribute
+    tokens = list(dict.fromkeys(token for token in _RE_SPACES.split(m.group(3)) if token))
+    if m.group(1).lower() == "rel" and "noreferrer" in tokens and "noopener" in tokens:
+        # noreferrer already does what noopener does
+        tokens.remove("noopener")
+    return f' {m.group(1)}={m.group(2)}{" ".join(tokens)}{m.group(2)}' if tokens else ""
+
+def _compact_tag(m: re.Match[str]) -> str:
+    slash, name, attributes, space = m.groups()
+    if name is None:
+        return m.group()
+    if "=" in attributes:
+        lower = attributes.lower()
+        if "class" in lower or "rel" in lower:
+            attributes = _RE_TOKEN_ATTRIBUTE.sub(_compact_attribute, attributes)
+    if space and name.lower() in _STRUCTURE_TAGS and _RE_STRUCTURE_TAG.match(m.string, m.end()):
+        space = ""
+    return f"<{slash}{name}{attributes}>{space}"
+
+def compact_html(text: str) -> str:
+    """ Remove the bytes that don't change the page: repeated or extra whitespace in class and rel attributes (and empty
+    ones), noopener when there's noreferrer, and whitespace between table and section tags
+    What's inside pre, script, style and textarea tags is left as it is """
+    parts = []
+    position = 0
+    for m in _RE_VERBATIM.finditer(text):
+        parts.append(_RE_TAG.sub(_compact_tag, text[position:m.start()]))
+        parts.append(m.group())
+        position = m.end()
+    parts.append(_RE_TAG.sub(_compact_tag, text[position:]))
+    return "".join(parts)
+
+
+class CompactOutputPreprocessor(Preprocessor):
+    """ Clears the stats at the start of every document """
+    def run(self, lines):
+        self.md.compaction_stats = {"bytes_before": 0, "bytes_after": 0, "bytes_saved": 0}
+        return lines
+
+
+class CompactOutputPostprocessor(Postprocessor):
+    """ Compacts the HTML once everything else is done, and adds what it saved to md.compaction_stats """
+    def __init__(self, md: Markdown, ext: "CompactOutputExtension"):
+        super().__init__(md)
+        self.ext = ext
+
+    def run(self, text):
+        compacted = compact_html(text)
+        # Everything that's removed is ASCII, so it's one byte per character
+        saved = len(text) - len(compacted)
+        before = len(text.encode("utf-8"))
+        stats = self.md.compaction_stats
+        stats["bytes_before"] += before
+        stats["bytes_after"] += before - saved
+        stats["bytes_saved"] += saved
+        self.ext.bytes_saved += saved
+        return compacted
+
+    def run_fragment(self, text):
+        # The sections rendered separately by ShardedSectionsExtension are compacted too, but only the page is counted
+        return compact_html(text)
+
+
+class CompactOutputExtension(Extension):
+    """Extension to make the HTML smaller, without changing how the page looks or works (see compact_html)
+    Mostly helps with the class attributes of ExtendedTable (which start with a space, and can repeat classes),
+    the rel of LinkBlank, and big tables (which have a line for each row and cell)
+
+    md.compaction_stats has the bytes_before, bytes_after and bytes_saved of the last document (the fragments of
+    ShardedSectionsExtension are compacted too, but not counted), and the extension keeps the bytes_saved by all
+    the documents"""
+    def extendMarkdown(self, md):
+        md.registerExtension(self)
+        self.md = md
+        self.bytes_saved = 0
+        md.compaction_stats = {"bytes_before": 0, "bytes_after": 0, "bytes_saved": 0}
+        md.preprocessors.register(CompactOutputPreprocessor(md), "compact_output", 100)
+        # After raw_html (30) and amp_substitute (20), so the large tables and the raw HTML are compacted too
+        md.postprocessors.register(CompactOutputPostprocessor(md, self), "compact_output", 2)
+
+    def __init__(self, **kwargs):
+        self.config = {}
+        super(CompactOutputExtension, self).__init__(**kwargs)
+
+
+def get_compaction_stats(md: Markdown) -> dict[str, int]:
+    """ Get the stats of the last document converted by md (empty if CompactOutputExtension wasn't added) """
+    return getattr(md, "compaction_stats", {})
+
+
+def makeExtension(**kwargs):
+    """ Lets Markdown load the extension by the name of this module """
+    return CompactOutputExtension(**kwargs)
@@ -1,45 +1,187 @@
 from markdown.extensions import tables
 from markdown.extensions import Extension
-from typing import Sequence
+from markdown.treeprocessors import Treeprocessor
+from markdown import util
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Iterator, NamedTuple, Sequence
+import copy
+import itertools
 import xml.etree.ElementTree as etree
 import re
-import copy
 
-ROWSPAN_DICT_DEFAULT = {"rowspan": 1, "colspan": 1}
-
-ROW_CLASS_PATTERN = r'\+\.[_\-a-zA-Z][_\-a-zA-Z\d]*'
-CELL_CLASS_PATTERN = r'(?<!\+)\.[_\-a-zA-Z][_\-a-zA-Z\d]*'
-ROW_HIGHLIGHT_PATTERN = r'\+!\d+'
-CELL_HIGHLIGHT_PATTERN = r'(?<!\+)!\d+'
-COLSPAN_PATTERN = r'\>\d+'
-ROWSPAN_PATTERN = r'\^\d+'
-PROPERTIES_PATTERN = (r'^!{ *'
-                      f'({ROW_CLASS_PATTERN} *)*' # Group 1
-                      f'({CELL_CLASS_PATTERN} *)*' # Group 2
-                      f'({ROW_HIGHLIGHT_PATTERN} *)*' # Group 3
-                      f'({CELL_HIGHLIGHT_PATTERN} *)*' # Group 4
-                      f'({COLSPAN_PATTERN} *)?' # Group 5
-                      f'({ROWSPAN_PATTERN} *)?' # Group 6
-                      r'}')
+from .trigger_prescan_extension import is_skipped
+
+PROPERTIES_CACHE_SIZE = 1024 # Number of different !{...} to remember, tables tend to reuse the same few over and over
+
+# A single property inside !{...}, followed by any number of spaces
+# Groups 1 and 2 are the prefix (+. or .) and name of a class, groups 3 and 4 the prefix (+!, !, > or ^) and number of the others
+_RE_PROPERTY = re.compile(r'(\+?\.)([_\-a-zA-Z][_\-a-zA-Z\d]*) *|(\+?!|[>^])(\d+) *')
+
+class CellProperties(NamedTuple):
+    """Properties of a cell, as parsed from the !{...} at its start"""
+    row_classes: tuple[str, ...]
+    cell_classes: tuple[str, ...]
+    row_highlights: tuple[str, ...]
+    cell_highlights: tuple[str, ...]
+    colspan: int | None
+    rowspan: int | None
+    row_class: str # Classes and highlights of the row, ready to be appended to its class attribute
+    cell_class: str # Same as above, for the cell
+
+@lru_cache(maxsize=PROPERTIES_CACHE_SIZE)
+def parse_properties(spec: str) -> CellProperties | None:
+    """Parse a whole !{...}, with the properties in any order
+    Returns None if it's not valid (unknown properties, or colspan/rowspan specified more than once)"""
+    row_classes = []
+    cell_classes = []
+    row_highlights = []
+    cell_highlights = []
+    colspan = None
+    rowspan = None
+
+    end = len(spec) - 1 # Position of the closing }
+    pos = 2 # Skip the opening !{
+    while pos < end and spec[pos] == ' ':
+        pos += 1
+    while pos < end:
+        m = _RE_PROPERTY.match(spec, pos, end)
+        if not m:
+            return None
+        prefix = m.group(1) or m.group(3)
+        if prefix == '+.':
+            row_classes.append(m.group(2))
+        elif prefix == '.':
+            cell_classes.append(m.group(2))
+        elif prefix == '+!':
+            row_highlights.append(m.group(4))
+        elif prefix == '!':
+            cell_highlights.append(m.group(4))
+        elif prefix == '>':
+            if colspan is not None:
+                return None
+            colspan = int(m.group(4))
+        else: # ^
+            if rowspan is not None:
+                return None
+            rowspan = int(m.group(4))
+        pos = m.end()
+
+    row_class = ''.join(f" {c}" for c in row_classes) + ''.join(f" table-highlight-{n}" for n in row_highlights)
+    cell_class = ''.join(f" {c}" for c in cell_classes) + ''.join(f" table-highlight-{n}" for n in cell_highlights)
+    return CellProperties(tuple(row_classes), tuple(cell_classes), tuple(row_highlights), tuple(cell_highlights),
+                          colspan, rowspan, row_class, cell_class)
+
+class TableSpanError(ValueError):
+    """Raised when a cell spans over another one, or past the edges of the table"""
+    def __init__(self, row: int, column: int, message: str):
+        self.row = row
+        self.column = column
+        super().__init__(f"Table row {row}, column {column}: {message}")
+
+
+class TableState:
+    """Everything about the table being parsed, which is passed along instead of being kept by ExtendedTableProcessor,
+    so the processor doesn't change while it parses a table (and can parse more than one at once)"""
+    __slots__ = ('border', 'align', 'rowspans', 'colspans', 'row_num', 'row_count')
+
+    def __init__(self, border: int, align: list[str | None], row_count: int):
+        self.border = border # PIPE_LEFT and PIPE_RIGHT, if the header starts/ends with a pipe
+        self.align = align
+        # For each column, how many more rows are covered by the cell that starts there, and how many columns it covers
+        self.rowspans = array('I', [0]) * len(align)
+        self.colspans = array('I', [1]) * len(align)
+        self.row_num = 0 # Number of the row being built (the header is 1)
+        self.row_count = row_count # Including the header
+
+
+class TableDocument:
+    """What ExtendedTableProcessor found in the current document, for the treeprocessors"""
+    __slots__ = ('pending_tables', 'tables', 'rendered_cells')
+
+    def __init__(self):
+        # Tables found by the large table mode, waiting to be rendered by ExtendedTableHtmlTreeprocessor
+        # as (index in the htmlStash, block)
+        self.pending_tables = []
+        # Tables built by the normal mode, when memoize_cells is on, for ExtendedTableCellTreeprocessor
+        self.tables = []
+        # Cells rendered by ExtendedTableCellTreeprocessor, for ExtendedTableCellFillTreeprocessor, as (cell, rendered)
+        self.rendered_cells = []
+
 
 class ExtendedTableProcessor(tables.TableProcessor):
-    # I could've figured out a regex that matched the flags in any order
-    # However, that sounds like a lot of pain, and I'm not even sure if it would be possible with regex only
-    # Add to that the fact that, even using groups, m.group(i) only returns the last match if a group matched multiple times
-    # https://docs.python.org/3/library/re.html#re.Match.group
-    # So I've just kept them in a fixed order, I don't think anyone would find it too much of an issue
-    # (if anyone else apart from me were ever to use this extension, that is)
-    # (also, it's definitely possible to have the flags in any order by just using iteration)
-    def run(self, parent: etree.Element, blocks: list[str]):
-        # Unfortunately I had to copy the whole function because I can't intercept len(align) otherwise
-        """ Parse a table block and build table. """
-        block = blocks.pop(0).split('\n')
-        header = block[0].strip(' ')
-        rows = [] if len(block) < 3 else block[2:]
+    # The properties are parsed by parse_properties, which reads them one at a time, so they can be in any order
+    # Nothing about a table is stored in the processor (unlike TableProcessor, which keeps what test found for run),
+    # it's all in a TableState, and what's left for the treeprocessors is in document (replaced on every reset)
+    def __init__(self, parser, config):
+        super().__init__(parser, config)
+        self.document = TableDocument()
+
+    def test(self, parent: etree.Element, block: str) -> bool:
+        if is_skipped(self.parser.md, 'extended_table'):
+            return False
+        return self._read_header(block) is not None
+
+    def _read_header(self, block: str) -> tuple[int, list[str]] | None:
+        """ Same as TableProcessor.test, but returns the border and the cells of the separator of the table
+        (or None if it's not one) instead of storing them, and only the lines that are needed are split from the block
+        (which for most tables are just the first two) """
+        rows = self._iter_rows(block, 0)
+        header0 = next(rows)
+        separator = next(rows, None)
+        if separator is None:
+            return None
+        border = tables.PIPE_NONE
+        if header0.startswith('|'):
+            border |= tables.PIPE_LEFT
+        if self.RE_END_BORDER.search(header0) is not None:
+            border |= tables.PIPE_RIGHT
+        row = self._split_row(header0, border)
+        row0_len = len(row)
+        is_table = row0_len > 1
+
+        # Each row in a single column table needs at least one pipe.
+        if not is_table and row0_len == 1 and border:
+            for row in itertools.chain((separator,), rows):
+                is_table = row.startswith('|')
+                if not is_table:
+                    is_table = self.RE_END_BORDER.search(row) is not None
+                if not is_table:
+                    break
+
+        if is_table:
+            row = self._split_row(separator, border)
+            if (len(row) == row0_len) and set(''.join(row)) <= set('|:- '):
+                return border, row
+        return None
+
+    def _split_row(self, row: str, border: int) -> list[str]:
+        """ Same as TableProcessor._split_row, with the border of the table given """
+        if border:
+            if row.startswith('|'):
+                row = row[1:]
+            row = self.RE_END_BORDER.sub('', row)
+        return self._split(row)
+
+    @staticmethod
+    def _iter_rows(block: str, start: int) -> Iterator[str]:
+        """ Yield the lines of block from start, stripped of spaces, one at a time
+        Same as block[start:].split('\n'), without making a copy of the whole block at once """
+        block_len = len(block)
+        while start <= block_len:
+            end = block.find('\n', start)
+            if end == -1:
+                end = block_len
+            yield block[start:end].strip(' ')
+            start = end + 1
+
+    def _new_state(self, block: str) -> TableState:
+        border, separator = self._read_header(block)
 
         # Get alignment of columns
         align: list[str | None] = []
-        for c in self.separator:
+        for c in separator:
             c = c.strip(' ')
             if c.startswith(':') and c.endswith(':'):
                 align.append('center')
@@ -50,101 +192,367 @@ class ExtendedTableProcessor(tables.TableProcessor):
             else:
                 align.append(None)
 
-        # Initialize rowspans
-        self.rowspans = []
-        for k in range(len(align)):
-            self.rowspans.append(copy.deepcopy(ROWSPAN_DICT_DEFAULT))
+        return TableState(border, align, block.count('\n')) # Lines, minus the separator
+
+    def run(self, parent: etree.Element, blocks: list[str]):
+        # Unfortunately I had to copy the whole function because I can't intercept len(align) otherwise
+        """ Parse a table block and build table. """
+        # The rows are read from the block one at a time while the table is built, instead of splitting it all first
+        block = blocks.pop(0)
+        state = self._new_state(block)
+
+        threshold = self.config['large_table_cells']
+        if threshold and state.row_count * len(state.align) >= threshold:
+            self._stash_table(parent, block)
+            return
 
         # Build table
+        rows = self._iter_rows(block, 0)
+        header = next(rows)
+        next(rows) # Separator, already read by _new_state
         table = etree.SubElement(parent, 'table')
+        if self.config['memoize_cells']:
+            self.document.tables.append(table)
         thead = etree.SubElement(table, 'thead')
-        self._build_row(header, thead, align)
+        self._build_row(state, header, thead)
         tbody = etree.SubElement(table, 'tbody')
-        if len(rows) == 0:
+        if state.row_count == 1:
             # Handle empty table
-            self._build_empty_row(tbody, align)
+            self._build_empty_row(tbody, state.align)
         else:
             for row in rows:
-                self._build_row(row.strip(' '), tbody, align)
+                self._build_row(state, row, tbody)
 
-    def _build_row(self, row: str, parent: etree.Element, align: Sequence[str | None]) -> None:
+    def _build_row(self, state: TableState, row: str, parent: etree.Element) -> None:
         """ Given a row of text, build table cells. """
         tr = etree.SubElement(parent, 'tr')
         tag = 'td'
         if parent.tag == 'thead':
             tag = 'th'
-        cells = self._split_row(row)
+        row_class, cells = self._parse_row(state, row)
+        if row_class:
+            tr.attrib['class'] = row_class
+        for text, attrib in cells:
+            c = etree.SubElement(tr, tag, attrib)
+            c.text = text
+
+    def _parse_row(self, state: TableState, row: str) -> tuple[str, list[tuple[str, dict[str, str]]]]:
+        """ Get the class of a row, and the text and attributes of each of its cells (with the properties applied) """
+        cells = self._split_row(row, state.border)
+        align = state.align
+        rowspans = state.rowspans
+        colspans = state.colspans
         # We use align here rather than cells to ensure every row
         # contains the same number of columns.
 
+        state.row_num += 1
+        row_classes = [] # Joined once at the end, instead of making a new string for each cell that adds some
+        parsed = []
+        columns = len(align)
         i = 0 # "actual" index of the cell (if you consider colspanned cells as separate)
         j = 0 # index of cell as being read from the file
-        while i < len(align):
-            if self.rowspans[i]["rowspan"] < 2:
+        while i < columns:
+            if rowspans[i] == 0:
                 a = align[i] # Get the align value for this column
-                c = etree.SubElement(tr, tag) # Create the td
+                attrib = {}
                 colspan = 1
                 rowspan = 1
                 try:
                     text = cells[j] # Get the text inside the cell WITHOUT stripping
-                    m = re.match(PROPERTIES_PATTERN, text) # Try to match with the properties at the beginning (right after the pipe)
-                    if m:
-                        if m.group(1) is not None: # If the first group matched, it matched with +.
-                            if 'class' not in tr.attrib:
-                                tr.attrib['class'] = ''
-                            for m2 in re.finditer(ROW_CLASS_PATTERN, text): # Get the highlight number
-                                tr.attrib['class'] = f"{tr.attrib['class']} {m2.group(0)[2:]}" # Apply class
-
-                        if m.group(2) is not None: # If the second group matched, it matched with .
-                            if 'class' not in c.attrib:
-                                c.attrib['class'] = ''
-                            for m2 in re.finditer(CELL_CLASS_PATTERN, text):  # Get the highlight number
-                                c.attrib['class'] = f"{c.attrib['class']} {m2.group(0)[1:]}"  # Apply class
-
-                        if m.group(3) is not None: # If the third group matched, it matched with +!
-                            if 'class' not in tr.attrib:
-                                tr.attrib['class'] = ''
-                            for m2 in re.finditer(ROW_HIGHLIGHT_PATTERN, text): # Get the highlight number
-                                tr.attrib['class'] = f"{tr.attrib['class']} table-highlight-{m2.group(0)[2:]}" # Apply class
-
-                        if m.group(4) is not None: # If the fourth group matched, it matched with !
-                            if 'class' not in c.attrib:
-                                c.attrib['class'] = ''
-                            for m2 in re.finditer(CELL_HIGHLIGHT_PATTERN, text):  # Get the highlight number
-                                c.attrib['class'] = f"{c.attrib['class']} table-highlight-{m2.group(0)[1:]}"  # Apply class
-
-                        if m.group(5) is not None: # If the fifth group matched, it matched with >
-                            colspan = int(re.search(COLSPAN_PATTERN, text).group(0)[1:])
-                            c.attrib['colspan'] = str(colspan) # Apply colspan
-
-                        if m.group(6) is not None: # If the sixth group matched, it matched with ^
-                            rowspan = int(re.search(ROWSPAN_PATTERN, text).group(0)[1:])
-                            c.attrib['rowspan'] = str(rowspan)
-
-
-                        self.rowspans[i]["rowspan"] = rowspan # Set the rowspan for this cell
-                        self.rowspans[i]["colspan"] = colspan # Set the colspan for this cell
+                    # Check for properties at the beginning (right after the pipe)
+                    properties = None
+                    if text.startswith('!{'):
+                        spec_end = text.find('}') + 1
+                        if spec_end:
+                            properties = parse_properties(text[:spec_end])
+                    if properties is not None:
+                        if properties.row_class: # Apply classes and highlights to the row (there could be some from the previous cells)
+                            row_classes.append(properties.row_class)
+                        if properties.cell_class: # Apply classes and highlights to the cell
+                            attrib['class'] = properties.cell_class
+
+                        if properties.colspan is not None:
+                            colspan = properties.colspan
+                            attrib['colspan'] = str(colspan) # Apply colspan
+
+                        if properties.rowspan is not None:
+                            rowspan = properties.rowspan
+                            attrib['rowspan'] = str(rowspan)
+
+
+                        self._check_spans(state, i, colspan, rowspan)
+                        rowspans[i] = rowspan - 1 if rowspan > 1 else 0 # Set the rowspan for this cell
+                        colspans[i] = colspan if colspan > 1 else 1 # Set the colspan for this cell
                         if colspan > 1: # Skip n-1 cells if cell has n colspan
                             i += colspan - 1
+                        text = text[spec_end:] # Remove the properties
 
-                    c.text = re.sub(PROPERTIES_PATTERN, '', text).strip() # Remove the properties, strip, and set as the text of the cell
+                    text = text.strip() # Strip, and use as the text of the cell
                 except IndexError:  # pragma: no cover
-                    c.text = "" # Create an extra empty cell if there aren't enough in the row
+                    text = "" # Create an extra empty cell if there aren't enough in the row
                 finally:
                     j += 1
                 if a:
                     if self.config['use_align_attribute']:
-                        c.set('align', a)
+                        attrib['align'] = a
                     else:
-                        c.set('style', f'text-align: {a};')
+                        attrib['style'] = f'text-align: {a};'
+                parsed.append((text, attrib))
             else: # if there's a cell in a previous row that has a rowspan overriding this cell, don't generate anything and decrement the counter
-                k = i
                 j += 1 # Skip dummy cell in markdown
-                if self.rowspans[k]["colspan"] != 0:
-                    i += self.rowspans[k]["colspan"] - 1 # Skip extra cells if rowspanned column also has rowspan
-                self.rowspans[k]["rowspan"] -= 1 # Decrease remaining
+                rowspans[i] -= 1 # Decrease remaining
+                i += colspans[i] - 1 # Skip extra cells if rowspanned column also has colspan
 
             i += 1
+        return ''.join(row_classes), parsed
+
+    def _stash_table(self, parent: etree.Element, block: str) -> None:
+        """ Leave a placeholder in the htmlStash for a large table, where its HTML will be put by
+        ExtendedTableHtmlTreeprocessor (the cells can only be rendered once all the blocks have been parsed, since they
+        can use link references defined after the table)
+        Only the block is kept until then, its rows are parsed by iter_table_rows while the HTML is being made """
+        html_stash = self.parser.md.htmlStash
+        p = etree.SubElement(parent, 'p')
+        p.text = html_stash.store('')
+        self.document.pending_tables.append((html_stash.html_counter - 1, block))
+
+    def iter_table_rows(self, block: str) -> Iterator[tuple[str, str, list[tuple[str, dict[str, str]]]]]:
+        """ Parse the rows of a table block one at a time, and yield them as (tag of the cells, *_parse_row(row)),
+        without creating any element """
+        state = self._new_state(block)
+        rows = self._iter_rows(block, 0)
+        header = next(rows)
+        next(rows) # Separator
+        yield 'th', *self._parse_row(state, header)
+        if state.row_count == 1:
+            # Same as _build_empty_row
+            yield 'td', '', [(None, {}) for _ in state.align]
+        else:
+            for row in rows:
+                yield 'td', *self._parse_row(state, row)
+
+    def _check_spans(self, state: TableState, column: int, colspan: int, rowspan: int) -> None:
+        """ Raise TableSpanError if a cell starting at column (in the current row) would go past the edges of the table,
+        or over a cell from a previous row """
+        if column + colspan > len(state.rowspans):
+            raise TableSpanError(state.row_num, column + 1,
+                                 f"colspan of {colspan} goes past the last column ({len(state.rowspans)})")
+        if rowspan - 1 > state.row_count - state.row_num:
+            raise TableSpanError(state.row_num, column + 1,
+                                 f"rowspan of {rowspan} goes past the last row ({state.row_count})")
+        for k in range(column + 1, column + colspan):
+            if state.rowspans[k]:
+                raise TableSpanError(state.row_num, column + 1,
+                                     f"colspan of {colspan} overlaps the rowspan of the cell in column {k + 1}")
+
+# Start of the placeholders of the htmlStash, which are only valid in the document they were made in
+_HTML_PLACEHOLDER_START = util.HTML_PLACEHOLDER.split('%s')[0]
+
+class CellMemo:
+    """The rendered inline Markdown of the text of cells, so cells with the same text are only rendered once
+    Everything is remembered until the end of the document, and (if max_size is set) the max_size most recently used
+    are kept for the next documents too, as long as the inline patterns and the configs of the extensions don't change
+    Cells with links ([) are only remembered within a document, since the references are different in each of them,
+    and footnote references ([^) are never remembered, since they're numbered in the order they're used"""
+    def __init__(self, max_size: int = 0):
+        self.max_size = max_size
+        self.document = {} # {(kind, text): rendered}
+        self.shared = OrderedDict() # Same, but kept across documents, least recently used first
+        self.signature = None
+
+    def start_document(self, md) -> None:
+        """ Forget what was remembered for the previous document, and everything if md renders differently now """
+        self.document = {}
+        signature = self._signature(md)
+        if signature != self.signature:
+            self.shared.clear()
+            self.signature = signature
+
+    def render(self, kind: str, texts: Sequence[str | None], render: Callable[[list[str | None]], list]) -> list:
+        """ Same as render(texts), but render is only called for the texts that aren't remembered already
+        (once for each different text), kind tells apart what different callers get out of render """
+        results = [None] * len(texts)
+        missing = [] # Texts to render
+        missing_positions = [] # For each of them, the positions in texts that use it
+        missing_index = {} # {text: index in missing}
+        for position, text in enumerate(texts):
+            if text is None or '[^' in text:
+                missing.append(text)
+                missing_positions.append([position])
+                continue
+            key = (kind, text)
+            rendered = self.document.get(key)
+            if rendered is None and key in self.shared:
+                self.shared.move_to_end(key)
+                rendered = self.document[key] = self.shared[key]
+            if rendered is not None:
+                results[position] = rendered
+            elif text in missing_index:
+                missing_positions[missing_index[text]].append(position)
+            else:
+                missing_index[text] = len(missing)
+                missing.append(text)
+                missing_positions.append([position])
+
+        for text, rendered, positions in zip(missing, render(missing), missing_positions):
+            if text in missing_index:
+                self._remember((kind, text), rendered)
+            for position in positions:
+                results[position] = rendered
+        return results
+
+    def _remember(self, key: tuple[str, str], rendered) -> None:
+        self.document[key] = rendered
+        if not self.max_size or '[' in key[1]:
+            return
+        rendered_text = rendered if isinstance(rendered, str) else ''.join(rendered.itertext())
+        if _HTML_PLACEHOLDER_START in rendered_text:
+            return # Contains raw HTML, which is in this document's htmlStash
+        self.shared[key] = rendered
+        if len(self.shared) > self.max_size:
+            self.shared.popitem(last=False)
+
+    @staticmethod
+    def _signature(md) -> tuple:
+        """ Everything that can change the result of the inline patterns """
+        patterns = [(item.name, item.priority, md.inlinePatterns[item.name]) for item in md.inlinePatterns._priority]
+        return (tuple(sorted((name, priority, type(processor).__qualname__, id(processor))
+                             for name, priority, processor in patterns)),
+                tuple((type(ext).__qualname__, repr(sorted(ext.getConfigs().items()))) for ext in md.registeredExtensions),
+                tuple(md.ESCAPED_CHARS), md.output_format)
+
+
+class ExtendedTableCellTreeprocessor(Treeprocessor):
+    """ When memoize_cells is on, render the inline Markdown of the cells of the tables built by ExtendedTableProcessor
+    (only once for each different text), before the inline processor gets to them
+    The cells are left empty so the inline processor skips them, and ExtendedTableCellFillTreeprocessor gives them the
+    result right after it, so the treeprocessors after the inline one (eg: abbr's) see them like any other cell """
+    BATCH_SIZE = 1024 # Number of cells to process with the inline processor at once
+
+    def __init__(self, md, processor: ExtendedTableProcessor, memo: CellMemo):
+        super().__init__(md)
+        self.processor = processor
+        self.memo = memo
+
+    def run(self, root):
+        self.memo.start_document(self.md)
+        document = self.processor.document
+        tables, document.tables = document.tables, []
+        if 'inline' not in self.md.treeprocessors:
+            return
+        # Footnote references are left to the inline processor, so they're numbered in the order they are in the document
+        cells = [cell for table in tables for row in table.iter('tr') for cell in row if cell.text and '[^' not in cell.text]
+        rendered = self.memo.render('tree', [cell.text for cell in cells], self._render_texts)
+        document.rendered_cells = list(zip(cells, rendered))
+        for cell in cells:
+            cell.text = None
+
+    def _render_texts(self, texts: list[str]) -> list[etree.Element]:
+        """ Get an element for each of the texts, with the inline patterns applied to it """
+        rendered = []
+        inline = self.md.treeprocessors['inline']
+        for batch_start in range(0, len(texts), self.BATCH_SIZE):
+            batch = etree.Element('div')
+            for text in texts[batch_start:batch_start + self.BATCH_SIZE]:
+                etree.SubElement(batch, 'td').text = text
+            inline.run(batch)
+            rendered.extend(batch)
+        return rendered
+
+class ExtendedTableCellFillTreeprocessor(Treeprocessor):
+    """ Put what ExtendedTableCellTreeprocessor rendered in its cells, once the inline processor is done """
+    def __init__(self, md, processor: ExtendedTableProcessor):
+        super().__init__(md)
+        self.processor = processor
+
+    def run(self, root):
+        document = self.processor.document
+        rendered_cells, document.rendered_cells = document.rendered_cells, []
+        for cell, rendered in rendered_cells:
+            cell.text = rendered.text
+            for child in rendered:
+                cell.append(copy.deepcopy(child))
+
+class ExtendedTableHtmlTreeprocessor(Treeprocessor):
+    """ Render the tables found by the large table mode of ExtendedTableProcessor straight to HTML, and put it in the
+    htmlStash placeholder that was left for them
+    Runs before the inline processor, which is only used on the text of the cells (a batch at a time) """
+    BATCH_SIZE = 1024 # Number of cells to process with the inline treeprocessors at once
+
+    def __init__(self, md, processor: ExtendedTableProcessor, memo: CellMemo | None = None):
+        super().__init__(md)
+        self.processor = processor
+        self.memo = memo
+
+    def run(self, root):
+        document = self.processor.document
+        pending_tables, document.pending_tables = document.pending_tables, []
+        for index, block in pending_tables:
+            html = self._render_table(self.processor.iter_table_rows(block))
+            self.md.htmlStash.rawHtmlBlocks[index] = html
+            if 'loading="lazy"' in html:
+                # So ImageLoadingTreeprocessor counts its imgs too
+                self.md.image_html_blocks.append(index)
+
+    def _render_table(self, rows: Iterator[tuple[str, str, list[tuple[str | None, dict[str, str]]]]]) -> str:
+        # Same layout as the tree of the normal mode once it's been prettified and serialized
+        # The rows are parsed and rendered a batch at a time, so only the HTML of the table is kept in memory
+        html = ['<table>\n<thead>\n']
+        self._render_rows([next(rows)], html)
+        html.append('</thead>\n<tbody>\n')
+        batch = []
+        batch_cells = 0
+        for row in rows:
+            batch.append(row)
+            batch_cells += len(row[2])
+            if batch_cells >= self.BATCH_SIZE:
+                self._render_rows(batch, html)
+                batch = []
+                batch_cells = 0
+        self._render_rows(batch, html)
+        html.append('</tbody>\n</table>')
+        return ''.join(html)
+
+    def _render_rows(self, rows: list[tuple[str, str, list[tuple[str | None, dict[str, str]]]]], html: list[str]) -> None:
+        """ Append the HTML of rows to html """
+        cells = self._render_cells([(tag, text) for tag, _, row_cells in rows for text, _ in row_cells])
+        cell_num = 0
+        for tag, row_class, row_cells in rows:
+            html.append(f'<tr class="{row_class}">' if row_class else '<tr>')
+            if row_cells:
+                html.append('\n') # Prettify doesn't add it to rows that are all covered by rowspans
+            for _, attrib in row_cells:
+                # Sorted, like Markdown's serializer does
+                attributes = ''.join(f' {name}="{value}"' for name, value in sorted(attrib.items()))
+                html.append(f'<{tag}{attributes}>{cells[cell_num]}</{tag}>\n')
+                cell_num += 1
+            html.append('</tr>\n')
+
+    def _render_cells(self, cells: list[tuple[str, str | None]]) -> list[str]:
+        """ Get the HTML inside each of the cells, given as (tag, text) """
+        if self.memo is not None:
+            # The tag doesn't change what's inside the cell
+            return self.memo.render('html', [text for _, text in cells],
+                                    lambda texts: self._render_texts([('td', text) for text in texts]))
+        return self._render_texts(cells)
+
+    def _render_texts(self, cells: list[tuple[str, str | None]]) -> list[str]:
+        html = [''] * len(cells)
+        serializer = self.md.serializer
+        treeprocessors = [self.md.treeprocessors[name] for name in ('inline', 'unescape') if name in self.md.treeprocessors]
+        for batch_start in range(0, len(cells), self.BATCH_SIZE):
+            # The cells are put in a temporary element, to run the inline processor on all of them at once
+            batch = etree.Element('div')
+            for tag, text in cells[batch_start:batch_start + self.BATCH_SIZE]:
+                etree.SubElement(batch, tag).text = text
+            for treeprocessor in treeprocessors:
+                treeprocessor.run(batch)
+            for cell_num, cell in enumerate(batch, batch_start):
+                if cell.text or len(cell):
+                    # Only keep what's between the tags
+                    html[cell_num] = serializer(cell)[len(cell.tag) + 2:-len(cell.tag) - 3]
+        return html
+
 
 class ExtendedTableExtension(Extension):
     """ Add tables to Markdown, with the following extensions:
@@ -157,7 +565,7 @@ class ExtendedTableExtension(Extension):
     ><number>  : Apply colspan of <number> to cell
     ^<number>  : Apply rowspan of <number> to cell
 
-    The options must be specified in this order, but multiple values for the same attribute can be applied (except for rowspan/colspan), and can be separated by spaces
+    The options can be specified in any order, and multiple values for the same attribute can be applied (except for rowspan/colspan), and can be separated by spaces
     Example:
         |!{.center-align +!1 >3} text|
     Creates
@@ -213,7 +621,19 @@ class ExtendedTableExtension(Extension):
             <td>D</td>
         </tr>
 
-    IMPORTANT: malformed tables (eg: having cells with a colspan and rowspan that are overlapping) will generate unexpected results
+    IMPORTANT: malformed tables (eg: having cells with a colspan and rowspan that are overlapping, or going past the edges of the table)
+    raise a TableSpanError, telling the row (counting the header as 1) and column where the problem is
+
+    Takes four config options:
+    'use_align_attribute' (default: False) uses the align attribute for the alignment of the columns, instead of style
+    'large_table_cells' (default: 0) if set, tables with at least this many cells (including the header) are rendered
+        straight to HTML, without creating elements for the rows and cells, which is faster and uses less memory
+        The HTML is the same, but the cells are not seen by treeprocessors other than the inline one (eg: attr_list's,
+        or abbr's, so abbreviations are left as they are in those tables)
+    'memoize_cells' (default: False) renders the inline Markdown of cells with the same text (eg: Yes/No, @@o) only once
+        per document, and copies the result to the others (see CellMemo for the cells that are left out)
+    'cell_cache_size' (default: 0) if set with memoize_cells, this many of the most recently used cells are remembered
+        for the next documents too (until the inline patterns or the config of an extension change)
 
     This extensions inherits from TableProcessor/TableExtension, and only modifies the _build_row and run() functions
     """
@@ -221,6 +641,11 @@ class ExtendedTableExtension(Extension):
     def __init__(self, **kwargs):
         self.config = {
             'use_align_attribute': [False, 'True to use align attribute instead of style.'],
+            'large_table_cells': [0, 'Number of cells (including the header) from which a table is rendered straight to HTML '
+                                     '(0 to never do it)'],
+            'memoize_cells': [False, 'True to render the inline Markdown of cells with the same text only once per document'],
+            'cell_cache_size': [0, 'Number of rendered cells to keep for the next documents too, when memoize_cells is on '
+                                   '(0 to only keep them within a document)'],
         }
         """ Default configuration options. """
 
@@ -230,5 +655,28 @@ class ExtendedTableExtension(Extension):
         """ Add an instance of `TableProcessor` to `BlockParser`. """
         if '|' not in md.ESCAPED_CHARS:
             md.ESCAPED_CHARS.append('|')
-        processor = ExtendedTableProcessor(md.parser, self.getConfigs())
-        md.parser.blockprocessors.register(processor, 'extended_table', 75)
+        md.registerExtension(self)
+        self.md = md
+        self.processor = ExtendedTableProcessor(md.parser, self.getConfigs())
+        md.parser.blockprocessors.register(self.processor, 'extended_table', 75)
+        # Kept by the extension, so what's remembered across documents outlives md.reset()
+        self.memo = CellMemo(self.getConfig('cell_cache_size')) if self.getConfig('memoize_cells') else None
+        # Right before the inline processor (20)
+        if self.memo is not None:
+            md.treeprocessors.register(ExtendedTableCellTreeprocessor(md, self.processor, self.memo), 'extended_table_cells', 22)
+            # And right after it
+            md.treeprocessors.register(ExtendedTableCellFillTreeprocessor(md, self.processor), 'extended_table_cells_fill', 19)
+        if self.getConfig('large_table_cells'):
+            md.image_html_blocks = [] # Large tables with lazy imgs, as their index in the htmlStash
+            md.treeprocessors.register(ExtendedTableHtmlTreeprocessor(md, self.processor, self.memo), 'extended_table_html', 21)
+
+    def reset(self):
+        # In case a document failed before its tables were rendered
+        self.processor.document = TableDocument()
+        if self.getConfig('large_table_cells'):
+            self.md.image_html_blocks = []
+
+
+def makeExtension(**kwargs):
+    """ Lets Markdown load the extension by the name of this module """
+    return ExtendedTableExtension(**kwargs)
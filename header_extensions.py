@@ -3,42 +3,112 @@ from markdown.inlinepatterns import InlineProcessor
 from markdown.blockprocessors import BlockProcessor
 from markdown.extensions import Extension
 from markdown.preprocessors import Preprocessor
+from typing import Iterable, Iterator
 import xml.etree.ElementTree as etree
 import re
 import markdown
 
+from .trigger_prescan_extension import is_skipped
+
 _RE_HEADERS = re.compile(r'#+(?= )', re.UNICODE | re.DOTALL)
+_RE_INNER_HEADERS = re.compile(r'\n#+(?= )', re.UNICODE) # A header at the start of any line but the first
+
+LINE_BLANK = "blank"
+LINE_TEXT = "text"
+LINE_HEADER = "header"
+LINE_FENCE = "fence"
+
+# Opening line of a fenced code block, as the fenced_code extension matches it: the fence, and an optional language
+# (or {attrs}) and hl_lines, up to the end of the line
+_RE_FENCE = re.compile(r'(?P<fence>~{3,}|`{3,})[ ]*(?:\{[^\n]*\}|(?:\.?[\w#.+-]*[ ]*)?(?:hl_lines=(?P<quot>"|\').*?(?P=quot)[ ]*)?)',
+                       re.UNICODE)
+
+def classify_lines(lines: Iterable[str], fences: bool = True) -> Iterator[tuple[str, str, int]]:
+    """Look at each line once, and yield it as (kind, line, level)
+    kind is one of LINE_HEADER, LINE_FENCE, LINE_BLANK or LINE_TEXT, and level is the number of #s for headers (0 otherwise)
+    Headers are only recognized at the start of the line and outside of fenced code blocks (which are all LINE_TEXT)
+    Pass fences=False when the fenced_code extension isn't used, since the fences are just text then
+    NOTE: a fence that's never closed is considered open until the end"""
+    fence = None # Opening fence of the code block the current line is in, if any
+    for line in lines:
+        if fence is not None:
+            if line.startswith(fence) and line.rstrip(' ') == fence:
+                fence = None
+                yield LINE_FENCE, line, 0
+            else:
+                yield LINE_TEXT, line, 0
+        elif line.startswith('#'):
+            result = _RE_HEADERS.match(line)
+            if result:
+                yield LINE_HEADER, line, len(result.group())
+            else:
+                yield LINE_TEXT, line, 0
+        elif fences and line.startswith(('~~~', '```')) and (result := _RE_FENCE.fullmatch(line)):
+            fence = result.group('fence')
+            yield LINE_FENCE, line, 0
+        elif not line.strip():
+            yield LINE_BLANK, line, 0
+        else:
+            yield LINE_TEXT, line, 0
+
+def split_top_level_sections(lines: list[str], fences: bool = True) -> list[tuple[int, int, int]]:
+    """Split lines in the sections SectionsViaHeaders would create at the top level, as (start, end, level)
+    Each one goes from a header to the next one of the same level (the headers in between are its subsections)
+    The lines before the first header, if any, are returned as a section of level 0
+    fences is the same as for classify_lines"""
+    sections = []
+    start = 0
+    level = 0
+    for line_num, (kind, line, header_level) in enumerate(classify_lines(lines, fences)):
+        if kind == LINE_HEADER and (level == 0 or header_level == level):
+            if line_num > start:
+                sections.append((start, line_num, level))
+            start = line_num
+            level = header_level
+    if len(lines) > start:
+        sections.append((start, len(lines), level))
+    return sections
+
 
 class AddBlanksAroundHeadersPreprocessor(Preprocessor):
     """ Add a blank line before and after all headers if not already present
-    This is needed because all headers must be alone in their own block for SectionsViaHeaders to work"""
+    This is needed because all headers must be alone in their own block for SectionsViaHeaders to work
+
+    Sets md.blanks_around_headers, so SectionsViaHeaders knows that every header at the start of a line is alone in its
+    block, and only blocks starting with one count"""
     def run(self, lines):
-        new_lines = [] # Lines are stored in a separate lists because it would be a pain to have a list that mutates while iterating on it
-        for line_num, line in enumerate(lines):
-            if re.search(_RE_HEADERS, line): # Check if current line is a header
-                # Check previous and next line, and add blanks if needed
-                if lines[line_num - 1] != '':
-                    new_lines.append('')
-                new_lines.append(line)
-                if lines[line_num + 1] != '':
-                    new_lines.append('')
-            else:
-                new_lines.append(line)
-        return new_lines
+        self.md.blanks_around_headers = True
+        return list(self._add_blanks(lines))
+
+    def _add_blanks(self, lines: Iterable[str]) -> Iterator[str]:
+        previous = LINE_BLANK # The start of the document doesn't need a blank
+        for kind, line, level in classify_lines(lines, 'fenced_code_block' in self.md.preprocessors):
+            # Add a blank when going from a header to something else or the other way around, unless there's one already
+            if previous != LINE_BLANK and kind != LINE_BLANK and LINE_HEADER in (kind, previous):
+                yield ''
+            yield line
+            previous = kind
 
 
 class AddBlanksAroundHeadersExtension(Extension):
-    """Extension to add blank lines before and after headers, ensuring each is in its own block"""
+    """Extension to add blank lines before and after headers, ensuring each is in its own block
+    Only lines starting with #s followed by a space are headers, and lines in fenced code blocks are left alone"""
     def extendMarkdown(self, md):
         md.registerExtension(self)
         self.md = md
+        md.blanks_around_headers = False
         md.preprocessors.register(AddBlanksAroundHeadersPreprocessor(md), 'header-blanks', 200)
 
+    def reset(self):
+        self.md.blanks_around_headers = False
+
 class SectionsViaHeadersBlockProcessor(BlockProcessor):
     """Wraps sections of the document delimited by headers of different level in <section> tags"""
 
     def test(self, parent, block):
-        return re.match(_RE_HEADERS, block)
+        if is_skipped(self.parser.md, 'header-sections'):
+            return False
+        return _RE_HEADERS.match(block)
 
     def run(self, parent, blocks):
         def _wrap(wrap_end: int) -> None:
@@ -54,9 +124,11 @@ class SectionsViaHeadersBlockProcessor(BlockProcessor):
             for i in range(0, wrap_end):
                 blocks.pop(0)
 
+        if getattr(self.parser.md, 'blanks_around_headers', False):
+            self._split_headers(blocks)
         # First of all, get the starting block, what has matched (the #s), and how many of them there are
         starting_block = blocks[0]
-        starting_match = re.match(_RE_HEADERS, starting_block).group()
+        starting_match = _RE_HEADERS.match(starting_block).group()
         starting_level = len(starting_match) # Number of #s in the header
         header_text = starting_block[starting_level + 1:] # Get the actual text in the header
 
@@ -65,11 +137,9 @@ class SectionsViaHeadersBlockProcessor(BlockProcessor):
             if block_num == 0:
                 # Skip the block that initiated the search
                 continue
-            result = re.search(_RE_HEADERS, block)
-            if result:
+            ending_level = self._block_level(block)
+            if ending_level:
                 # If another header is found, check if it's the same level of heading
-                ending_match = result.group()
-                ending_level = len(ending_match)
                 if starting_level == ending_level:
                     # If it is, wrap everything up until it in a section
                     _wrap(block_num)
@@ -80,6 +150,130 @@ class SectionsViaHeadersBlockProcessor(BlockProcessor):
         _wrap(block_num + 1)
         return True
 
+    def _split_headers(self, blocks: list[str]) -> None:
+        """Once AddBlanksAroundHeaders is used, a header it didn't see (eg: in a blockquote or a list, where it's not at
+        the start of the line) can still have other lines after it in its block
+        Only its first line is the header then, and the rest is put back in blocks right after it, to be parsed as usual
+        (and split again if it starts with a header too)"""
+        block_num = 0
+        while block_num < len(blocks):
+            block = blocks[block_num]
+            if '\n' in block and _RE_HEADERS.match(block):
+                blocks[block_num:block_num + 1] = block.split('\n', 1)
+            block_num += 1
+
+    def _block_level(self, block: str) -> int:
+        """Get the level of the header in block that would end a section (0 if there's none)
+        Normally a header anywhere in the block is enough, but once AddBlanksAroundHeaders has put every header in
+        its own block, only blocks starting with one count (so text like "C# code", or a header in a blockquote, doesn't)
+        Both engines use this, so they always give the same HTML"""
+        if getattr(self.parser.md, 'blanks_around_headers', False):
+            # More than one blank line before a header leaves the extra ones at the start of its block
+            block = block.lstrip('\n')
+            if block.startswith('#'):
+                result = _RE_HEADERS.match(block)
+                if result:
+                    return len(result.group())
+            return 0
+        result = _RE_HEADERS.search(block)
+        return len(result.group()) if result else 0
+
+
+class StackSectionsViaHeadersBlockProcessor(SectionsViaHeadersBlockProcessor):
+    """Same output as SectionsViaHeadersBlockProcessor, but all the headers (and their levels) are found in a single pass,
+    and the nested <section>s are built with an explicit stack instead of rescanning the blocks and recursing for every level
+    Only the blocks between headers are handed to the parser"""
+
+    def run(self, parent, blocks):
+        if getattr(self.parser.md, 'blanks_around_headers', False):
+            self._split_headers(blocks)
+        levels, starts = self._scan_levels(blocks)
+        if levels is None:
+            # Some block has a header that's not alone in it, and the parser may split it in a new block while parsing
+            # The original processor handles that by searching again from that point, so let it do the work
+            return super().run(parent, blocks)
+        block_count = len(blocks)
+
+        # Find where each section ends, which is the next block with a header of the same level (or the end of the blocks)
+        # Going backwards means that the next header of each level is always the last one seen
+        ends = [block_count] * block_count
+        next_header = {}
+        for block_num in range(block_count - 1, -1, -1):
+            level = levels[block_num]
+            if level:
+                ends[block_num] = next_header.get(level, block_count)
+                next_header[level] = block_num
+
+        # Each item is an element that's still open, and the block number where it ends
+        # A section can't outlive the one containing it, so its end is capped to the one of its parent
+        stack = [(parent, block_count)]
+        content_start = 0 # First block that still needs to be parsed into the element on top of the stack
+        block_num = 0
+        while True:
+            element, end = stack[-1]
+            if block_num == end:
+                # Parse what's left of the section, and go back to its parent
+                # The block that ended the section is checked again, since it belongs to the parent
+                if content_start < block_num:
+                    self.parser.parseBlocks(element, blocks[content_start:block_num])
+                content_start = block_num
+                if len(stack) == 1:
+                    break
+                stack.pop()
+                continue
+            if starts[block_num]:
+                # Parse the blocks before the header, and open a new section
+                if content_start < block_num:
+                    self.parser.parseBlocks(element, blocks[content_start:block_num])
+                level = levels[block_num]
+                section = etree.SubElement(element, 'section')
+                child = etree.SubElement(section, f'h{level}')
+                child.text = blocks[block_num][level + 1:]
+                section.attrib["class"] = f"section-level-{level}"
+                stack.append((section, min(ends[block_num], end)))
+                content_start = block_num + 1
+            block_num += 1
+
+        # Everything has been used
+        del blocks[:]
+        return True
+
+    def _scan_levels(self, blocks: list[str]) -> tuple[list[int] | None, list[bool] | None]:
+        """Get the level of the header in each block (0 if there's none), and whether the block starts with it
+        Like the original processor, a header anywhere in a block is enough for it to end a section
+        Returns None, None if a header is on a line of its own in the middle of a block
+
+        If AddBlanksAroundHeaders has already put the headers in their own blocks, only blocks starting with a header
+        count (see _block_level)"""
+        if getattr(self.parser.md, 'blanks_around_headers', False):
+            return self._start_levels(blocks)
+
+        levels = []
+        starts = []
+        for block in blocks:
+            result = _RE_HEADERS.search(block)
+            if result:
+                if _RE_INNER_HEADERS.search(block):
+                    return None, None
+                levels.append(len(result.group()))
+                starts.append(result.start() == 0)
+            else:
+                levels.append(0)
+                starts.append(False)
+        return levels, starts
+
+    def _start_levels(self, blocks: list[str]) -> tuple[list[int] | None, list[bool] | None]:
+        """Same as _scan_levels, when only the headers at the start of the blocks count"""
+        levels = []
+        for block in blocks:
+            # A header can still be in the middle of a block (eg: in a fenced code block, which the extension
+            # doesn't touch), or after the blank lines at its start, and the parser may split it in a new block,
+            # so let the original processor handle those
+            if '\n#' in block and _RE_INNER_HEADERS.search(block):
+                return None, None
+            levels.append(self._block_level(block))
+        return levels, [level > 0 for level in levels]
+
 
 class SectionsViaHeadersExtension(Extension):
     """ Extention to wrap sections of the document delimited by headers of different level in <section> tags
@@ -108,8 +302,25 @@ class SectionsViaHeadersExtension(Extension):
     <section>
         <h1>Section 2</h1>
         foobar
-    </section>"""
+    </section>
+
+    Takes one config option:
+    'engine' (default: 'stack') selects how sections are built, both give the same output:
+        'stack' finds all the headers in one pass and builds the sections with a stack (StackSectionsViaHeadersBlockProcessor)
+        'recursive' searches for the end of each section and parses its content recursively (SectionsViaHeadersBlockProcessor)"""
+    ENGINES = {
+        'stack': StackSectionsViaHeadersBlockProcessor,
+        'recursive': SectionsViaHeadersBlockProcessor,
+    }
+
     def extendMarkdown(self, md):
         md.registerExtension(self)
         self.md = md
-        md.parser.blockprocessors.register(SectionsViaHeadersBlockProcessor(md.parser), 'header-sections', 201)
+        processor = self.ENGINES[self.getConfig("engine")]
+        md.parser.blockprocessors.register(processor(md.parser), 'header-sections', 201)
+
+    def __init__(self, **kwargs):
+        self.config = {
+            "engine": ["stack", "Engine used to build the sections: 'stack' or 'recursive'"],
+        }
+        super(SectionsViaHeadersExtension, self).__init__(**kwargs)
@@ -3,8 +3,11 @@ from markdown.extensions import Extension
 from markdown import Markdown
 import xml.etree.ElementTree as etree
 
-class WarningHighlightProcessor(InlineProcessor):
+from .trigger_prescan_extension import SkippableInlineProcessor
+
+class WarningHighlightProcessor(SkippableInlineProcessor, InlineProcessor):
     SPAN_CLASS = "text-warning"
+    TRIGGER = "warning_highlight"
     def handleMatch(self, m, data):
         el = etree.Element("span")
         el.text = m.group(1)
@@ -23,8 +26,9 @@ class WarningHighlightExtension(Extension):
 
 
 
-class TextHighlightProcessor(InlineProcessor):
+class TextHighlightProcessor(SkippableInlineProcessor, InlineProcessor):
     SPAN_CLASS_PARTIAL = "text-highlight-"
+    TRIGGER = "text_highlight"
     def handleMatch(self, m, data):
         el = etree.Element("span")
         el.text = m.group(2)
@@ -60,8 +64,9 @@ class UnsureHighlightExtension(Extension):
         super(UnsureHighlightExtension, self).__init__(**kwargs)
 
 
-class UnsureHighlightProcessor(InlineProcessor):
+class UnsureHighlightProcessor(SkippableInlineProcessor, InlineProcessor):
     SPAN_CLASS = "text-unsure"
+    TRIGGER = "unsure_highlight"
 
     def handleMatch(self, m, data):
         el = etree.Element('span')
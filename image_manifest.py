@@ -0,0 +1,247 @@
+from markdown.treeprocessors import Treeprocessor
+from markdown import Markdown, util
+import xml.etree.ElementTree as etree
+import html
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+
+MANIFEST_VERSION = 1
+
+# JPEG markers that have no length after them
+_JPEG_STANDALONE = {0x01, *range(0xD0, 0xDA)}
+# Start of frame markers (the ones with the size of the image), all the 0xCn except DHT, JPG and DAC
+_JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_EXIF_ORIENTATION = 0x0112
+
+# The src of imgs, and the href of the links around imgs or pictures (a SmallImage thumbnail links to the full image)
+_RE_IMAGE_URL = re.compile(r'<img\b[^>]*?\ssrc="([^"]*)"|<a\b[^>]*?\shref="([^"]*)"[^>]*>\s*<(?:img|picture)\b')
+# The loading attribute of a lazy img, in HTML made by Markdown's serializer (everything before it is group 1)
+_RE_LAZY_IMAGE = re.compile(r'(<img\b[^>]*?)\sloading="lazy"')
+
+
+def image_size(path: str | os.PathLike) -> tuple[int, int] | None:
+    """ Get the (width, height) of the PNG, JPEG, GIF or WebP image at path, from its header only (the pixels are never
+    decoded, and the file is mapped instead of read, so only the pages with the header are loaded)
+    None if the file can't be read or isn't one of those formats """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:8] == b"\x89PNG\r\n\x1a\n":
+                return _png_size(data)
+            if data[:2] == b"\xff\xd8":
+                return _jpeg_size(data)
+            if data[:6] in (b"GIF87a", b"GIF89a"):
+                return struct.unpack_from("<HH", data, 6)
+            if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+                return _webp_size(data)
+    # ValueError for empty files (which can't be mapped), struct.error and IndexError for truncated ones
+    except (OSError, ValueError, struct.error, IndexError):
+        pass
+    return None
+
+def _png_size(data: mmap.mmap) -> tuple[int, int] | None:
+    # IHDR is always the first chunk
+    if data[12:16] != b"IHDR":
+        return None
+    return struct.unpack_from(">II", data, 16)
+
+def _jpeg_size(data: mmap.mmap) -> tuple[int, int] | None:
+    position = 2
+    orientation = 1
+    while True:
+        # Markers can be padded with any number of 0xFF
+        while data[position] == 0xFF and data[position + 1] == 0xFF:
+            position += 1
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        position += 2
+        if marker in _JPEG_STANDALONE:
+            continue
+        length, = struct.unpack_from(">H", data, position)
+        if marker == 0xE1 and data[position + 2:position + 8] == b"Exif\0\0":
+            orientation = _exif_orientation(data, position + 8)
+        elif marker in _JPEG_SOF:
+            height, width = struct.unpack_from(">HH", data, position + 3)
+            # Browsers show the image rotated by its orientation, so 90° rotations swap the sides
+            return (height, width) if orientation >= 5 else (width, height)
+        position += length
+
+def _exif_orientation(data: mmap.mmap, tiff: int) -> int:
+    """ Get the orientation tag in the IFD0 of the EXIF data (a TIFF header) starting at tiff, 1 if it's not there """
+    order = {b"II": "<", b"MM": ">"}.get(data[tiff:tiff + 2])
+    if order is None:
+        return 1
+    ifd, = struct.unpack_from(order + "I", data, tiff + 4)
+    entries, = struct.unpack_from(order + "H", data, tiff + ifd)
+    for i in range(entries):
+        tag, _, _, value = struct.unpack_from(order + "HHIH", data, tiff + ifd + 2 + i * 12)
+        if tag == _EXIF_ORIENTATION:
+            return value
+    return 1
+
+def _webp_size(data: mmap.mmap) -> tuple[int, int] | None:
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        # Lossy, 14 bits each after the frame tag and start code
+        width, height = struct.unpack_from("<HH", data, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        # Lossless, 14 bits each (minus one) after the signature byte
+        bits, = struct.unpack_from("<I", data, 21)
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        # Extended, 24 bits each (minus one)
+        return (int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1)
+    return None
+
+
+def local_path(images_dir: str, src: str) -> str | None:
+    """ Get the file the src of an image points to, relative to images_dir (also the ones starting with /),
+    or None if it's not a local file """
+    path = image_path(images_dir, src)
+    return path if path is not None and os.path.isfile(path) else None
+
+def image_path(images_dir: str, src: str) -> str | None:
+    """ Same as local_path, without checking that the file exists (None only for the images on other sites) """
+    if "://" in src or src.startswith(("data:", "//")):
+        return None
+    return os.path.normpath(os.path.join(images_dir, src.split("?", 1)[0].split("#", 1)[0].lstrip("/")))
+
+
+def image_urls(text: str) -> list[str]:
+    """ Get the URLs of the images shown in the HTML text (unescaped), read back from the HTML, so it doesn't matter which
+    extension made them, or if they came from a cached table cell """
+    return [html.unescape(src or href) for src, href in _RE_IMAGE_URL.findall(text)]
+
+
+class ImageManifest:
+    """Index of the sizes of images, so each one is only read once (and again when it changes)
+    With a path, the index is kept in that JSON file as {"version": 1, "images": {path: [mtime, size, width, height]}}
+    (width and height are null for the files that aren't images), so later runs only need to read it
+
+    Use get_manifest() to get the one for a path, so every extension using it shares the same one"""
+    def __init__(self, path: str | os.PathLike | None = None):
+        self.path = os.path.abspath(path) if path else None
+        self.images = {} # {path: [mtime, size, width, height]}
+        self.changed = False
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self.images = self._load()
+
+    def size(self, path: str) -> tuple[int, int] | None:
+        """ Get the (width, height) of the image at path, or None if it isn't one (see image_size) """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self.images.get(path)
+        if entry is None or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+            size = image_size(path)
+            entry = [stat.st_mtime_ns, stat.st_size, *(size or (None, None))]
+            self.images[path] = entry
+            self.changed = True
+        return (entry[2], entry[3]) if entry[2] is not None else None
+
+    def save(self) -> None:
+        """ Write the index to its file, if it has changed since it was read (does nothing without a path) """
+        if self.path is None or not self.changed:
+            return
+        with self._lock:
+            self.changed = False
+            # Copied, since other threads can add to it while it's written
+            images = dict(self.images)
+            temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump({"version": MANIFEST_VERSION, "images": images}, f, separators=(",", ":"))
+                os.replace(temp_path, self.path)
+            except OSError:
+                # The sizes are still known, they'll just have to be read again the next time
+                self.changed = True
+
+    def _load(self) -> dict[str, list]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Started over if it was written by another version
+        if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("images", {})
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+def get_manifest(path: str | os.PathLike | None = None) -> ImageManifest:
+    """ Get the ImageManifest kept in the file at path (or the in-memory one if it's not given) """
+    key = os.path.abspath(path) if path else None
+    with _manifests_lock:
+        if key not in _manifests:
+            _manifests[key] = ImageManifest(key)
+        return _manifests[key]
+
+
+def set_image_attributes(el: etree.Element, size: tuple[int, int] | None) -> None:
+    """ Set the size of an img (if it's known), and make it load lazily (ImageLoadingTreeprocessor makes the first ones eager) """
+    if size is not None:
+        el.set("width", str(size[0]))
+        el.set("height", str(size[1]))
+    el.set("loading", "lazy")
+    el.set("decoding", "async")
+
+
+class ImageLoadingTreeprocessor(Treeprocessor):
+    """Makes the first eager_images imgs with loading="lazy" of the document load right away again (the ones likely at
+    the top of the page, that would be shown later if they waited to be laid out), and saves the manifests that changed
+    Runs after the inline patterns, so it goes through the images in the order they are in the document,
+    wherever they were made (eg: in a table cell)
+    That includes the htmlStash blocks in md.image_html_blocks (their indexes), which are HTML made from Markdown
+    (eg: by the large table mode of ExtendedTableExtension), and are counted where their placeholder is"""
+    def __init__(self, md: Markdown, eager_images: int):
+        super().__init__(md)
+        self.eager_images = eager_images
+        self.manifests = []
+
+    def run(self, root):
+        eager = self.eager_images
+        if eager > 0:
+            html_blocks = getattr(self.md, "image_html_blocks", None)
+            for el in root.iter() if html_blocks else root.iter("img"):
+                if el.tag == "img":
+                    if el.get("loading") == "lazy":
+                        del el.attrib["loading"]
+                        eager -= 1
+                elif el.tag == "p" and el.text:
+                    result = util.HTML_PLACEHOLDER_RE.fullmatch(el.text)
+                    if result and int(result.group(1)) in html_blocks:
+                        eager = self._make_eager(int(result.group(1)), eager)
+                if eager == 0:
+                    break
+        for manifest in self.manifests:
+            manifest.save()
+
+    def _make_eager(self, index: int, eager: int) -> int:
+        """ Same as run, for the imgs in the HTML of the htmlStash block at index
+        Returns how many are left to make eager """
+        raw_html_blocks = self.md.htmlStash.rawHtmlBlocks
+        raw_html_blocks[index], count = _RE_LAZY_IMAGE.subn(r"\1", raw_html_blocks[index], eager)
+        return eager - count
+
+def register_image_loading(md: Markdown, manifest: ImageManifest, eager_images: int) -> None:
+    """ Add the ImageLoadingTreeprocessor to md, or update the one that's already there (every extension that sets
+    image sizes shares it, so images are counted once; the highest eager_images is used) """
+    if "image_loading" in md.treeprocessors:
+        processor = md.treeprocessors["image_loading"]
+        processor.eager_images = max(processor.eager_images, eager_images)
+    else:
+        processor = ImageLoadingTreeprocessor(md, eager_images)
+        md.treeprocessors.register(processor, "image_loading", 15)
+    if manifest not in processor.manifests:
+        processor.manifests.append(manifest)
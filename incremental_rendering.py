@@ -0,0 +1,128 @@
+from typing import Iterable
+import hashlib
+import re
+
+from .header_extensions import split_top_level_sections
+from .rendering import DEFAULT_EXTENSIONS, Renderer
+
+# Stock extensions that don't keep anything from one part of the document to use in another one
+# (unlike eg: footnotes, abbr or toc), so the sections can be rendered on their own
+SECTION_LOCAL_EXTENSIONS = {"tables", "fenced_code", "attr_list", "def_list", "sane_lists", "nl2br", "admonition",
+                            "codehilite", "smarty", "legacy_attrs", "legacy_em"}
+# Same for the kdlf extensions. Not compact_output and sharded_sections, which work on the HTML of the whole page,
+# or instrumentation, which counts each document
+# ps2_buttons and small_image only count with image_sizes off, since the first eager_images of the page load eagerly
+SECTION_LOCAL_KDLF_EXTENSIONS = {"extended_tables", "add_blanks_around_headers", "sections_via_headers", "ps2_buttons",
+                                 "small_image", "link_blank", "warning_highlight", "text_highlight", "unsure_highlight",
+                                 "trigger_prescan"}
+_PAGE_IMAGE_EXTENSIONS = ("ps2_buttons", "small_image")
+
+# What can be before those inside blockquotes and lists (any indentation, >s and list markers, nested in any order)
+_LINE_START = r'^(?:[ \t>]|[*+-][ \t]|\d+[.)][ \t])*'
+# Reference link definitions can be used by any section, raw HTML blocks can contain lines that look like headers,
+# and fenced code blocks are replaced by the whole document's preprocessors in a way that can change the block
+# the following header ends up in
+_RE_CROSS_SECTION = re.compile(_LINE_START + r'(?:\[[^\]]*\]:|<|```|~~~)', re.MULTILINE)
+
+_SECTION_END = "</section>"
+
+
+def sections_render_alone(extensions: Iterable[str], extension_configs: dict[str, dict]) -> bool:
+    """ Whether rendering each top level section on its own and joining their HTML gives the same HTML as rendering the
+    whole document, with these extensions and configs (by their names in EXTENSIONS)
+    Splitting is only safe if the sections are split exactly where the headers are, and the extensions only look at
+    their own section """
+    return ("sections_via_headers" in extensions and "add_blanks_around_headers" in extensions
+            and all(name in SECTION_LOCAL_EXTENSIONS or name in SECTION_LOCAL_KDLF_EXTENSIONS for name in extensions)
+            and not any(extension_configs.get(name, {}).get("image_sizes") for name in _PAGE_IMAGE_EXTENSIONS))
+
+
+class IncrementalRenderer(Renderer):
+    """Renderer that remembers the HTML of every section created by SectionsViaHeaders, and only renders again
+    the sections whose source changed since the last document
+    A section is rendered again as a whole only if its header or the text before its first subsection changed,
+    otherwise only the subsections that changed are rendered, and the HTML is put together from the remembered pieces
+    The HTML is the same as a full render (changing the level of a header just changes which sections are rendered again)
+
+    Documents with reference link definitions, raw HTML blocks or fenced code blocks, or using extensions that are not in
+    SECTION_LOCAL_EXTENSIONS or SECTION_LOCAL_KDLF_EXTENSIONS (see sections_render_alone), are always rendered in full
+    Only the pieces used by the last document are remembered"""
+    def __init__(self, extensions: Iterable[str] = DEFAULT_EXTENSIONS, extension_configs: dict[str, dict] | None = None,
+                 **kwargs):
+        super().__init__(extensions, extension_configs, **kwargs)
+        self.incremental = sections_render_alone(self.extensions, self.extension_configs)
+        self.fences = 'fenced_code_block' in self.md.preprocessors # Whether ``` and ~~~ lines start fenced code blocks
+        self.cache = {} # {fingerprint: HTML}
+        self.rerendered = []
+        self.text = None # Last document rendered
+
+    def render_sections(self, text: str) -> tuple[str, list[tuple[int, str]]]:
+        """ Convert text to HTML, and get the sections that had to be rendered again as (line number, header line)
+        The text before the first header has an empty header line """
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        self.rerendered = []
+        self.text = text
+        if not self.incremental or _RE_CROSS_SECTION.search(text):
+            self.cache = {}
+            self.rerendered = [(start, lines[start] if level else "")
+                               for start, end, level in split_top_level_sections(lines, self.fences)]
+            return self.render(text), self.rerendered
+
+        previous_cache, self.cache = self.cache, {}
+        html = []
+        for start, end, level in split_top_level_sections(lines, self.fences):
+            section_html = self._render_section(lines, start, end, level, previous_cache)
+            if section_html:
+                html.append(section_html)
+        return "\n".join(html), self.rerendered
+
+    def _render_section(self, lines: list[str], start: int, end: int, level: int, previous_cache: dict[bytes, str]) -> str:
+        """ Get the HTML of the section between lines start and end, reusing what's in previous_cache """
+        section_key = self._fingerprint("section", lines, start, end)
+        html = previous_cache.get(section_key)
+        if html is None:
+            if level == 0:
+                # Text before the first header, which can't have subsections
+                html = self.render("\n".join(lines[start:end]))
+                self.rerendered.append((start, ""))
+            else:
+                html = self._render_subsections(lines, start, end, previous_cache)
+        self.cache[section_key] = html
+        return html
+
+    def _render_subsections(self, lines: list[str], start: int, end: int, previous_cache: dict[bytes, str]) -> str:
+        """ Get the HTML of a section that changed, rendering only its own text and the subsections that changed """
+        subsections = [(sub_start + start + 1, sub_end + start + 1, level)
+                       for sub_start, sub_end, level in split_top_level_sections(lines[start + 1:end], self.fences)]
+        # The header and the text before the first subsection are rendered on their own
+        own_end = subsections[0][1] if subsections and subsections[0][2] == 0 else start + 1
+        own_key = self._fingerprint("own", lines, start, own_end)
+        own_html = previous_cache.get(own_key)
+        if own_html is None:
+            own_html = self.render("\n".join(lines[start:own_end]))
+            self.rerendered.append((start, lines[start]))
+        self.cache[own_key] = own_html
+
+        # The subsections go inside the <section>, right before it's closed
+        html = [own_html[:-len(_SECTION_END)]]
+        for sub_start, sub_end, level in subsections:
+            if level:
+                html.append(self._render_section(lines, sub_start, sub_end, level, previous_cache) + "\n")
+        html.append(_SECTION_END)
+        return "".join(html)
+
+    def _fingerprint(self, kind: str, lines: list[str], start: int, end: int) -> bytes:
+        digest = hashlib.blake2b(kind.encode(), digest_size=16)
+        for line in lines[start:end]:
+            digest.update(line.encode("utf-8") + b"\n")
+        return digest.digest()
+
+
+def render_incremental(old_text: str, new_text: str, renderer: IncrementalRenderer | None = None) -> tuple[str, list[tuple[int, str]]]:
+    """ Convert new_text to HTML, only rendering again the sections that are different from old_text
+    Returns the HTML, and the sections that were rendered again as (line number, header line)
+    If renderer already rendered old_text, the sections it remembers are used, otherwise old_text is rendered first """
+    renderer = renderer or IncrementalRenderer()
+    if renderer.text != old_text:
+        renderer.render_sections(old_text)
+    return renderer.render_sections(new_text)
@@ -4,6 +4,8 @@ from markdown import Markdown
 from xml.etree import ElementTree as etree
 import re
 
+from .trigger_prescan_extension import SkippableInlineProcessor
+
 LINK_RE_BLANK = NOIMG + r'\?\['
 
 class LinkBlankInlineExtension(Extension):
@@ -21,7 +23,9 @@ class LinkBlankInlineExtension(Extension):
         }
         super(LinkBlankInlineExtension, self).__init__(**kwargs)
 
-class LinkBlankInlineProcessor(LinkInlineProcessor):
+class LinkBlankInlineProcessor(SkippableInlineProcessor, LinkInlineProcessor):
+    TRIGGER = "link_blank"
+
     def __init__(self, pattern: str, md: Markdown, ext: LinkBlankInlineExtension):
         super().__init__(pattern)
         self.md = md
@@ -34,4 +38,9 @@ class LinkBlankInlineProcessor(LinkInlineProcessor):
             ret[0].attrib["target"] = "_blank"
             ret[0].attrib["rel"] = "noreferrer noopener"
             ret[0].text += self.extra_text
-        return ret
\ No newline at end of file
+        return ret
+
+
+def makeExtension(**kwargs):
+    """ Lets Markdown load the extension by the name of this module """
+    return LinkBlankInlineExtension(**kwargs)
@@ -0,0 +1,173 @@
+from markdown.extensions import Extension
+from markdown.postprocessors import Postprocessor
+from markdown.preprocessors import Preprocessor
+from markdown import Markdown
+import xml.etree.ElementTree as etree
+import functools
+import json
+import time
+
+# The processors of every module of this package are instrumented (apart from the ones in this module)
+_PACKAGE = __name__.rpartition(".")[0]
+
+
+def _new_stats() -> dict[str, int | float]:
+    return {"calls": 0, "matches": 0, "rejections": 0, "elements": 0, "seconds": 0.0}
+
+def _count_elements(elements) -> int:
+    return sum(1 for element in elements for _ in element.iter())
+
+
+class InstrumentationPreprocessor(Preprocessor):
+    """ Runs before anything else: instruments the processors that haven't been yet, and clears the stats """
+    def __init__(self, md: Markdown, ext: "InstrumentationExtension"):
+        super().__init__(md)
+        self.ext = ext
+
+    def run(self, lines):
+        self.ext.documents += 1
+        self.md.processor_stats = {}
+        for registry in (self.md.preprocessors, self.md.parser.blockprocessors, self.md.inlinePatterns,
+                         self.md.treeprocessors, self.md.postprocessors):
+            for processor in registry:
+                if id(processor) not in self.ext.instrumented and self._is_kdlf(processor):
+                    self.ext.instrumented.add(id(processor))
+                    self._instrument(processor, type(processor).__qualname__)
+        return lines
+
+    def _is_kdlf(self, processor) -> bool:
+        module = type(processor).__module__
+        return module.rpartition(".")[0] == _PACKAGE and module != __name__
+
+    def _instrument(self, processor, name: str) -> None:
+        """ Replace the methods of processor (only on this instance) with ones that record their stats """
+        md = self.md
+
+        def _stats() -> dict[str, int | float]:
+            stats = md.processor_stats.get(name)
+            if stats is None:
+                stats = md.processor_stats[name] = _new_stats()
+            return stats
+
+        if hasattr(processor, "handleMatch"):
+            handle_match = processor.handleMatch
+            @functools.wraps(handle_match)
+            def _handle_match(m, data):
+                start = time.perf_counter()
+                result = handle_match(m, data)
+                stats = _stats()
+                stats["seconds"] += time.perf_counter() - start
+                stats["calls"] += 1
+                if result[0] is None:
+                    stats["rejections"] += 1
+                else:
+                    stats["matches"] += 1
+                    if isinstance(result[0], etree.Element):
+                        stats["elements"] += _count_elements((result[0],))
+                return result
+            processor.handleMatch = _handle_match
+
+        elif hasattr(processor, "test"):
+            # Block processor: Markdown calls test with every block, and run only with the ones it accepts,
+            # which can still turn out not to match (run returns False then)
+            test = processor.test
+            @functools.wraps(test)
+            def _test(parent, block):
+                start = time.perf_counter()
+                result = test(parent, block)
+                stats = _stats()
+                stats["seconds"] += time.perf_counter() - start
+                stats["calls"] += 1
+                if not result:
+                    stats["rejections"] += 1
+                return result
+            processor.test = _test
+
+            run = processor.run
+            @functools.wraps(run)
+            def _run(parent, blocks):
+                children = len(parent)
+                start = time.perf_counter()
+                result = run(parent, blocks)
+                stats = _stats()
+                stats["seconds"] += time.perf_counter() - start
+                if result is False:
+                    stats["rejections"] += 1
+                else:
+                    stats["matches"] += 1
+                    stats["elements"] += _count_elements(parent[children:])
+                return result
+            processor.run = _run
+
+        else:
+            # Pre/tree/postprocessor: they always run once per document
+            run = processor.run
+            @functools.wraps(run)
+            def _run(*args):
+                start = time.perf_counter()
+                result = run(*args)
+                stats = _stats()
+                stats["seconds"] += time.perf_counter() - start
+                stats["calls"] += 1
+                return result
+            processor.run = _run
+
+
+class InstrumentationPostprocessor(Postprocessor):
+    """ Runs after everything else: writes the stats of the document to the JSON lines file, if there's one """
+    def __init__(self, md: Markdown, ext: "InstrumentationExtension"):
+        super().__init__(md)
+        self.ext = ext
+
+    def run(self, text):
+        path = self.ext.getConfig("jsonl_path")
+        if path:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"document": self.ext.documents, "processors": self.md.processor_stats}) + "\n")
+        return text
+
+    def run_fragment(self, text):
+        # Sections rendered separately by ShardedSectionsExtension are part of the same document
+        return text
+
+
+class InstrumentationExtension(Extension):
+    """Extension that records what every kdlf processor did in each document, to find out which one is slow
+    For each processor (by the name of its class, eg: ExtendedTableProcessor), md.processor_stats has:
+    calls: how many times it was called (handleMatch for inline processors, test for block processors, run for the others)
+    matches/rejections: how many calls did something, or returned None, None, None (for block processors: test
+        returned False, or run returned False for a block test accepted)
+    elements: how many elements were created by the calls that matched
+    seconds: total time spent in the processor (including the processors it calls, eg: the blocks inside a section,
+        but not the time Markdown takes to search for the patterns of inline processors)
+    The stats are cleared at the start of every document, and processors that never ran are not there
+
+    Takes one config option:
+    'jsonl_path' (default: '') if set, the stats of each document are appended to this file as a line of JSON
+
+    Processors are only instrumented when this extension is added, so there's no overhead otherwise"""
+    def extendMarkdown(self, md):
+        md.registerExtension(self)
+        self.md = md
+        self.instrumented = set() # ids of the processors that have been instrumented already
+        self.documents = 0
+        md.processor_stats = {}
+        # First and last of all, so all the other processors are included
+        md.preprocessors.register(InstrumentationPreprocessor(md, self), "instrumentation", 1000)
+        md.postprocessors.register(InstrumentationPostprocessor(md, self), "instrumentation", -1000)
+
+    def __init__(self, **kwargs):
+        self.config = {
+            "jsonl_path": ["", "File to append the stats of each document to, as JSON lines"],
+        }
+        super(InstrumentationExtension, self).__init__(**kwargs)
+
+
+def get_processor_stats(md: Markdown) -> dict[str, dict[str, int | float]]:
+    """ Get the stats of the last document converted by md (empty if InstrumentationExtension wasn't added) """
+    return getattr(md, "processor_stats", {})
+
+
+def makeExtension(**kwargs):
+    """ Lets Markdown load the extension by the name of this module """
+    return InstrumentationExtension(**kwargs)
@@ -0,0 +1,126 @@
+from itertools import repeat
+from typing import Iterable
+import os
+import re
+
+from . import extension_name
+from . import rendering
+from .header_extensions import split_top_level_sections
+from .incremental_rendering import sections_render_alone, _LINE_START
+from .rendering import DEFAULT_EXTENSIONS, Renderer, _init_worker
+
+# Same as in incremental_rendering, except for reference link definitions, which are collected from all the sections
+# and given to each of them
+_RE_SERIAL_ONLY = re.compile(_LINE_START + r'(?:<|```|~~~)', re.MULTILINE)
+# Lines that could be reference link definitions (also inside blockquotes and lists), only used to know which sections to look at
+_RE_REFERENCE = re.compile(_LINE_START + r'\[[^\]]*\]:', re.MULTILINE)
+
+
+def _render_sections(texts: list[str], references: dict[str, tuple[str, str]]) -> list[str]:
+    """ Render each of texts in a worker, with the reference link definitions of the whole document """
+    renderer = rendering._worker_renderer
+    html = []
+    for text in texts:
+        renderer.md.references.update(references)
+        html.append(renderer.render(text))
+    return html
+
+def _section_references(text: str) -> dict[str, tuple[str, str]]:
+    """ Get the reference link definitions of a section, as they end up in md.references """
+    renderer = rendering._worker_renderer
+    try:
+        renderer.md.convert(text)
+        return dict(renderer.md.references)
+    finally:
+        renderer.md.reset()
+
+
+class ParallelSectionRenderer:
+    """Renders huge documents by splitting them at the top level sections SectionsViaHeaders creates, and rendering
+    the sections in a pool of worker processes
+    Each section is rendered all the way to HTML by its worker (so the htmlStash of each one is only used in there),
+    and the HTML of the sections is joined in order, which is the same as rendering the whole document at once
+    Reference link definitions are collected from the sections that have some first, and given to all of them
+
+    Documents are rendered in this process instead when that wouldn't give the same HTML: when they have raw HTML blocks or
+    fenced code blocks, when a reference is defined in more than one section, when the extensions are not
+    SectionsViaHeaders, AddBlanksAroundHeaders, and ones that only use their own section (see sections_render_alone,
+    which rules out eg: footnotes or toc, since they number or list things across the whole document, compact_output,
+    sharded_sections and image_sizes) or when they're smaller than min_size characters, since starting on the workers
+    isn't worth it
+
+    The pool is created the first time it's needed, use as a context manager or call close() to stop it"""
+    CHUNKS_PER_WORKER = 4 # Sections are sent in chunks of about the same size, a few for each worker to balance the load
+
+    def __init__(self, extensions: Iterable[str] = DEFAULT_EXTENSIONS, extension_configs: dict[str, dict] | None = None,
+                 workers: int | None = None, min_size: int = 256 * 1024, **kwargs):
+        self.extensions = tuple(map(extension_name, extensions))
+        self.extension_configs = {extension_name(name): config for name, config in (extension_configs or {}).items()}
+        self.kwargs = kwargs
+        self.workers = workers or os.cpu_count() or 1
+        self.min_size = min_size
+        self.parallel = sections_render_alone(self.extensions, self.extension_configs)
+        self.renderer = Renderer(self.extensions, self.extension_configs, **kwargs)
+        self._executor = None
+
+    def render(self, text: str) -> str:
+        if not self.parallel or len(text) < self.min_size or _RE_SERIAL_ONLY.search(text):
+            return self.renderer.render(text)
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        sections = ["\n".join(lines[start:end]) for start, end, _ in split_top_level_sections(lines)]
+        if len(sections) < 2:
+            return self.renderer.render(text)
+
+        executor = self._get_executor()
+        references = {}
+        defined_in = [section for section in sections if _RE_REFERENCE.search(section)]
+        for section_references in executor.map(_section_references, defined_in):
+            if references.keys() & section_references.keys():
+                # Whichever definition comes last is used everywhere, so all the sections must be parsed by the same Markdown
+                return self.renderer.render(text)
+            references.update(section_references)
+
+        html = []
+        for chunk_html in executor.map(_render_sections, self._chunks(sections), repeat(references)):
+            html.extend(section_html for section_html in chunk_html if section_html)
+        return "\n".join(html)
+
+    def _chunks(self, sections: list[str]) -> list[list[str]]:
+        """ Split sections in consecutive chunks of about the same number of characters """
+        target = sum(map(len, sections)) / (self.workers * self.CHUNKS_PER_WORKER)
+        chunks = [[]]
+        size = 0
+        for section in sections:
+            if size >= target:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(section)
+            size += len(section)
+        return chunks
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Only imported here, since it takes longer to import than the rest of the package
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                 initargs=(self.extensions, self.extension_configs, self.kwargs))
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.renderer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def render_parallel(text: str, extensions: Iterable[str] = DEFAULT_EXTENSIONS,
+                    extension_configs: dict[str, dict] | None = None, workers: int | None = None, **kwargs) -> str:
+    """ Render a single huge document with a ParallelSectionRenderer, see there for when it's rendered in parallel """
+    with ParallelSectionRenderer(extensions, extension_configs, workers, **kwargs) as renderer:
+        return renderer.render(text)
@@ -1,11 +1,15 @@
 from markdown import Markdown
 from markdown.inlinepatterns import InlineProcessor
 from markdown.extensions import Extension
+from .trigger_prescan_extension import SkippableInlineProcessor
+from .image_manifest import get_manifest, image_path, register_image_loading, set_image_attributes
 import xml.etree.ElementTree as etree
+import copy
+import os
 
-_ALL_BTNS_LOWER = "t|q|x|o|du|dl|dd|dr|l1|l2|l3|r1|r2|r3|st|se"
-_ALL_BTNS_UPPER = _ALL_BTNS_LOWER.upper()
-PS2_BUTTONS_PATTERN = r'(@{2,3})(' + _ALL_BTNS_LOWER + r'|' + _ALL_BTNS_UPPER + r')'
+# Any abbreviation-looking text after the @s, the processor then looks for the longest known abbreviation it starts with
+# (so adding buttons doesn't make the regex any longer)
+PS2_BUTTONS_PATTERN = r'(@{2,3})([a-zA-Z][a-zA-Z\d]*)'
 
 class PS2ButtonsExtension(Extension):
     """Extension to quickly insert images of PS2 buttons inline
@@ -14,9 +18,18 @@ class PS2ButtonsExtension(Extension):
     @@<abbreviation> replaces with the image of the button only, @@@<abbreviation> replaces with the image and name of the button as text
     To make things easier, the filenames (apart from the extension) of the image files must be the same as the abbreviations
 
-    Takes two config options:
+    Abbreviations can be written all lowercase or all uppercase
+
+    Takes three config options:
     'imgs_path' (default: '') indicates the path to the directory containing the image files
     'imgs_extension' (default: '.png') indicates the extension of the image files (without the dot)
+    'buttons' (default: {}) is a dict of {abbreviation: name} of more buttons to add (eg: the ones of another controller),
+        or to rename existing ones
+    'image_sizes' (default: False) gives the images their width and height (read from the image files, see ImageManifest),
+        and makes them load lazily, apart from the first eager_images of the document
+    'images_dir' (default: '.') directory the image files are in, to read their sizes (imgs_path is only the URL)
+    'image_manifest' (default: '') JSON file to keep the sizes in, so they're only read from the images once
+    'eager_images' (default: 2) number of images at the start of the document that are loaded right away
 
     Example:
     @@s → <span class='inline-button'><img ...></span>
@@ -24,18 +37,27 @@ class PS2ButtonsExtension(Extension):
     def extendMarkdown(self, md):
         md.registerExtension(self)
         self.md = md
-        md.inlinePatterns.register(PS2ButtonsProcessor(PS2_BUTTONS_PATTERN, md, self), "ps2_buttons", 175)
+        processor = PS2ButtonsProcessor(PS2_BUTTONS_PATTERN, md, self)
+        md.inlinePatterns.register(processor, "ps2_buttons", 175)
+        if processor.manifest is not None:
+            register_image_loading(md, processor.manifest, self.getConfig("eager_images"))
 
     def __init__(self, **kwargs):
         self.config = {
             #TODO: idk what the first item in the list does
             "imgs_path": ["", "Path to the image files"],
-            "imgs_extension": [".png", "Extension of the image files"]
+            "imgs_extension": [".png", "Extension of the image files"],
+            "buttons": [{}, "Dict of {abbreviation: name} of buttons to add to (or replace in) the PS2 ones"],
+            "image_sizes": [False, "Set the width and height of the images, and load them lazily"],
+            "images_dir": [".", "Directory the image files are in"],
+            "image_manifest": ["", "JSON file to keep the sizes of the images in"],
+            "eager_images": [2, "Number of images at the start of the document to load right away"],
         }
         super(PS2ButtonsExtension, self).__init__(**kwargs)
 
 
-class PS2ButtonsProcessor(InlineProcessor):
+class PS2ButtonsProcessor(SkippableInlineProcessor, InlineProcessor):
+    TRIGGER = "ps2_buttons"
     BUTTON_NAMES = {
         'q': "Square",
         'x': "Cross",
@@ -63,32 +85,66 @@ class PS2ButtonsProcessor(InlineProcessor):
 
         self.imgs_path = ext.getConfig("imgs_path")
         self.imgs_extension = ext.getConfig("imgs_extension")
+        self.button_names = {**self.BUTTON_NAMES, **{key.lower(): name for key, name in ext.getConfig("buttons").items()}}
+        self.max_length = max(len(abbreviation) for abbreviation in self.button_names)
+        self.manifest = None
+        if ext.getConfig("image_sizes"):
+            self.manifest = get_manifest(ext.getConfig("image_manifest"))
+            images_dir = os.path.abspath(ext.getConfig("images_dir"))
+            self.image_paths = {abbreviation: image_path(images_dir, f"{self.imgs_path}{abbreviation}.{self.imgs_extension}")
+                                for abbreviation in self.button_names}
 
-    def handleMatch(self, m, data):
-        button_match = m.group(2).lower() # Get the button abbreviation and make it lowercase
+        # All the possible elements are created once here, and each match gets a copy of one of them
+        self.templates = self._build_templates()
 
+    def handleMatch(self, m, data):
+        abbreviation, end = self._find_button(m.group(2), m.start(2))
         # Abort if the button abbreviation is not valid
-        # Could also be done later with a try/catch, but doing it here avoids creating nodes that would go wasted
-        if button_match not in self.BUTTON_NAMES:
+        if abbreviation is None:
             return None, None, None
 
-        # Create span that will contain the image and text if needed
-        e = etree.Element("span")
-        e.attrib["class"] = self.SPAN_CLASS
-
-        # Generate the img inside the span
-        img_e = etree.SubElement(e, "img")
-        img_e.attrib["src"] = f"{self.imgs_path}{button_match}.{self.imgs_extension}"
-        img_e.attrib["alt"] = self.BUTTON_NAMES[button_match]
-        # Get and check the type of match
-        type_match = m.group(1)
-        if type_match == "@@":
-            # Return the span as is
-            return e, m.start(0), m.end(0)
-        elif type_match == "@@@":
-            # Add text and return the span
-            e.tail = "&nbsp;" + self.BUTTON_NAMES[button_match]
-            return e, m.start(0), m.end(0)
-        else:
-            # This should be unreachable! If a breakpoint is hit here, it's probably a bug
-            return None, None, None
+        # Copy the template, since every element in the tree must be a separate one
+        e = copy.deepcopy(self.templates[m.group(1)][abbreviation])
+        if self.manifest is not None:
+            # Looked up every time, so an image that changed gets its new size (the manifest only reads it again then)
+            path = self.image_paths[abbreviation]
+            set_image_attributes(e[0], self.manifest.size(path) if path is not None else None)
+        return e, m.start(0), end
+
+    def _find_button(self, text: str, start: int) -> tuple[str | None, int | None]:
+        """ Get the longest abbreviation (made lowercase) that text starts with, and where it ends
+        Returns None, None if there's none """
+        for length in range(min(len(text), self.max_length), 0, -1):
+            abbreviation = text[:length]
+            # Mixed case abbreviations (eg: Du) are not valid
+            if not (abbreviation.islower() or abbreviation.isupper()):
+                continue
+            abbreviation = abbreviation.lower()
+            if abbreviation in self.button_names:
+                return abbreviation, start + length
+        return None, None
+
+    def _build_templates(self) -> dict[str, dict[str, etree.Element]]:
+        """ Create the elements of all the buttons in both styles, keyed by the @s and the abbreviation """
+        templates = {"@@": {}, "@@@": {}}
+        for abbreviation, name in self.button_names.items():
+            # Create span that will contain the image and text if needed
+            e = etree.Element("span")
+            e.attrib["class"] = self.SPAN_CLASS
+
+            # Generate the img inside the span
+            img_e = etree.SubElement(e, "img")
+            img_e.attrib["src"] = f"{self.imgs_path}{abbreviation}.{self.imgs_extension}"
+            img_e.attrib["alt"] = name
+            templates["@@"][abbreviation] = e
+
+            # Same span, with the name as text after it
+            e = copy.deepcopy(e)
+            e.tail = "&nbsp;" + name
+            templates["@@@"][abbreviation] = e
+        return templates
+
+
+def makeExtension(**kwargs):
+    """ Lets Markdown load the extension by the name of this module """
+    return PS2ButtonsExtension(**kwargs)
@@ -0,0 +1,215 @@
+from typing import Iterable
+import markdown
+import hashlib
+import json
+import os
+import tempfile
+
+from . import extension_name
+from .image_manifest import image_urls, local_path
+from .rendering import DEFAULT_EXTENSIONS, Renderer
+from .trigger_prescan_extension import TRIGGERS
+
+# The processors each kdlf extension adds, to know if its config can change the HTML of a document (see TRIGGERS)
+# Extensions not in here (eg: stock ones) are assumed to affect every document
+EXTENSION_PROCESSORS = {
+    "extended_tables": ("extended_table",),
+    "sections_via_headers": ("header-sections",),
+    "ps2_buttons": ("ps2_buttons",),
+    "small_image": ("small_image",),
+    "link_blank": ("link_blank",),
+    "warning_highlight": ("warning_highlight",),
+    "text_highlight": ("text_highlight",),
+    "unsure_highlight": ("unsure_highlight",),
+}
+
+# The options that make the HTML of an extension depend on the content of the images (their size, or their thumbnails),
+# and not only on their URLs
+IMAGE_OPTIONS = {
+    "small_image": ("thumbnails_dir", "image_sizes"),
+    "ps2_buttons": ("image_sizes",),
+}
+
+_package_digest = None
+
+def package_digest() -> str:
+    """ Hash of the source of this package and the version of Markdown, so a cache is never used with different code """
+    global _package_digest
+    if _package_digest is None:
+        digest = hashlib.sha256(markdown.__version__.encode())
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                with open(os.path.join(directory, name), "rb") as f:
+                    digest.update(name.encode() + b"\0" + f.read())
+        _package_digest = digest.hexdigest()
+    return _package_digest
+
+
+class RenderCache:
+    """Stores the rendered HTML of documents in a directory, so unchanged documents don't have to be rendered again
+    Each document is stored under a hash of its source, the extensions used, and the configs of the extensions that can
+    change its HTML (eg: changing the imgs_path of PS2ButtonsExtension only affects documents with @@ in them)
+    The code of this package and the version of Markdown are part of the hash too
+    When an extension's HTML depends on the image files (see IMAGE_OPTIONS), the mtime and size of the local images
+    shown by the document are stored with it, and it's rendered again when one of them changed (which images a document
+    shows is only known once it's rendered, so they can't be part of the hash)
+
+    Files are written to a temporary file and then moved in place, so a cache entry is never seen half written
+    When the cache gets bigger than max_bytes, the least recently used files are deleted (using their modification time,
+    which is updated on every hit)
+    hits, misses and evictions count what happened since the cache was created"""
+    SUFFIX = ".html"
+    EVICT_TO = 0.9 # Fraction of max_bytes to go down to when evicting
+
+    def __init__(self, directory: str | os.PathLike, max_bytes: int = 256 * 1024 * 1024,
+                 extensions: Iterable[str] = DEFAULT_EXTENSIONS, extension_configs: dict[str, dict] | None = None,
+                 renderer: Renderer | None = None):
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        self.extensions = tuple(map(extension_name, extensions))
+        self.extension_configs = {extension_name(name): config for name, config in (extension_configs or {}).items()}
+        # Created the first time something needs to be rendered, since a fully cached build may not need it
+        self.renderer = renderer
+        self._owns_renderer = False
+        # Directories the images that can change the HTML are in (none if the HTML only depends on their URLs)
+        self.images_dirs = sorted({os.path.abspath(self.extension_configs.get(name, {}).get("images_dir", "."))
+                                   for name, options in IMAGE_OPTIONS.items() if name in self.extensions
+                                   and any(self.extension_configs.get(name, {}).get(option) for option in options)})
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path in self._entries())
+
+    def key(self, text: str) -> str:
+        """ Get the key text is stored under """
+        digest = hashlib.sha256(package_digest().encode())
+        digest.update(json.dumps(self.extensions).encode())
+        for name in self.extensions:
+            if name in EXTENSION_PROCESSORS and not self._can_match(name, text):
+                # Nothing the extension does can change this document, so neither can its config
+                continue
+            digest.update(b"\0" + name.encode() + b"\0")
+            digest.update(json.dumps(self.extension_configs.get(name, {}), sort_keys=True, default=repr).encode())
+        digest.update(b"\0\0" + text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """ Get the HTML stored under key, or None if there's none (or one of its images changed) """
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                images = json.loads(f.readline())
+                html = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        if any(_stat(image) != stat for image, stat in images.items()):
+            self.misses += 1
+            return None
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass # Evicted by someone else in the meantime, but it's been read already
+        self.hits += 1
+        return html
+
+    def put(self, key: str, html: str, images: dict[str, list[int] | None] | None = None) -> None:
+        """ Store html under key, and evict old entries if the cache got too big
+        images are the {path: [mtime, size]} of the images it was rendered with (see images) """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The images are the first line
+        data = (json.dumps(images or {}) + "\n" + html).encode("utf-8")
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.size += len(data) - replaced
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def render(self, text: str) -> str:
+        """ Get the HTML of text from the cache, or render it and store it if it's not there """
+        key = self.key(text)
+        html = self.get(key)
+        if html is None:
+            if self.renderer is None:
+                self.renderer = Renderer(self.extensions, self.extension_configs)
+                self._owns_renderer = True
+            html = self.renderer.render(text)
+            self.put(key, html, self.images(html))
+        return html
+
+    def images(self, html: str) -> dict[str, list[int] | None]:
+        """ Get the {path: [mtime, size]} of the images shown in html that can change it """
+        images = {}
+        for url in image_urls(html):
+            for images_dir in self.images_dirs:
+                path = local_path(images_dir, url)
+                if path is not None:
+                    images[path] = _stat(path)
+        return images
+
+    def close(self) -> None:
+        """ Close the Renderer, if it was created by the cache """
+        if self._owns_renderer:
+            self.renderer.close()
+
+    def clear(self) -> None:
+        for path in self._entries():
+            os.unlink(path)
+        self.size = 0
+
+    def _can_match(self, name: str, text: str) -> bool:
+        return any(trigger in text for processor in EXTENSION_PROCESSORS[name] for trigger in TRIGGERS[processor][1])
+
+    def _path(self, key: str) -> str:
+        # Split in subdirectories by the first two characters, so no directory gets too many files
+        return os.path.join(self.directory, key[:2], key + self.SUFFIX)
+
+    def _entries(self) -> list[str]:
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            entries.extend(os.path.join(root, name) for name in files if name.endswith(self.SUFFIX))
+        return entries
+
+    def _evict(self) -> None:
+        """ Delete the least recently used entries until the cache is back under max_bytes
+        A bit more than needed is deleted, so the directory isn't scanned again on the next put """
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.EVICT_TO
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evictions += 1
+
+
+def _stat(path: str) -> list[int] | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
@@ -0,0 +1,208 @@
+from collections import deque
+from itertools import islice
+from typing import Iterable, Iterator
+from markdown import Markdown
+import os
+import threading
+import time
+
+from . import EXTENSIONS, extension_name, get_extension
+
+# The kdlf extensions are given by their name in EXTENSIONS, so they (and their configs) are plain strings and dicts,
+# which can be sent to other processes
+DEFAULT_EXTENSIONS = ("extended_tables", "add_blanks_around_headers", "sections_via_headers", "ps2_buttons",
+                      "small_image", "link_blank", "warning_highlight", "text_highlight", "unsure_highlight")
+
+
+def build_markdown(extensions: Iterable[str] = DEFAULT_EXTENSIONS, extension_configs: dict[str, dict] | None = None,
+                   **kwargs) -> Markdown:
+    """ Create a Markdown instance with the given extensions
+    Names in EXTENSIONS are the kdlf extensions (only their modules are imported), anything else is passed to Markdown
+    as is (eg: "tables", "md_in_html")
+    extension_configs is a dict of {name: {option: value}}, any other keyword argument is passed to Markdown """
+    extension_configs = {extension_name(name): config for name, config in (extension_configs or {}).items()}
+    instances = []
+    stock_configs = {}
+    for name in map(extension_name, extensions):
+        if name in EXTENSIONS:
+            instances.append(get_extension(name, **extension_configs.get(name, {})))
+        else:
+            instances.append(name)
+            if name in extension_configs:
+                stock_configs[name] = extension_configs[name]
+    return Markdown(extensions=instances, extension_configs=stock_configs, **kwargs)
+
+
+class Renderer:
+    """Keeps a configured Markdown instance to convert many documents with, instead of creating one for each of them
+    close() (or using it as a context manager) stops what the extensions started (eg: the processes making thumbnails)"""
+    def __init__(self, extensions: Iterable[str] = DEFAULT_EXTENSIONS, extension_configs: dict[str, dict] | None = None,
+                 **kwargs):
+        self.extensions = tuple(map(extension_name, extensions))
+        self.extension_configs = {extension_name(name): config for name, config in (extension_configs or {}).items()}
+        self.md = build_markdown(self.extensions, self.extension_configs, **kwargs)
+
+    def render(self, text: str) -> str:
+        """ Convert text to HTML, and reset the instance for the next document """
+        try:
+            return self.md.convert(text)
+        finally:
+            self.md.reset()
+
+    def render_file(self, path: str | os.PathLike) -> str:
+        with open(path, encoding="utf-8") as f:
+            return self.render(f.read())
+
+    def close(self) -> None:
+        """ Call close() on the extensions that have one """
+        for ext in self.md.registeredExtensions:
+            close = getattr(ext, "close", None)
+            if close is not None:
+                close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RenderStats:
+    """ How many pages were rendered, and how long it took """
+    def __init__(self):
+        self.pages = 0
+        self.seconds = 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return f"RenderStats(pages={self.pages}, seconds={self.seconds:.3f}, pages_per_second={self.pages_per_second:.1f})"
+
+
+class ConcurrentRenderer:
+    """Renders documents from many threads at once with the same configuration, with a pool of Renderers (one per thread)
+    This is not one Markdown instance shared by the threads: Markdown keeps the state of the document it's converting on
+    the instance (eg: the htmlStash and the references), and so do the kdlf extensions (on md, eg: md.blanks_around_headers,
+    md.skipped_processors or md.processor_stats, and on their processors, eg: the TableDocument of ExtendedTableProcessor),
+    so an instance can only convert one document at a time
+    Each thread gets its own Renderer, created the first time it renders something, and reused after that
+    render can be called from any thread, render_many renders in the renderer's own pool of worker threads
+    On free-threaded builds of Python (3.13+) the documents are actually rendered in parallel, otherwise this only helps
+    if the threads spend time on other things too (eg: reading the files)
+
+    The extensions are created once per thread, so they must not be instances (the names in EXTENSIONS are fine)
+    Use as a context manager, or call close() when done, to stop the threads"""
+    def __init__(self, extensions: Iterable[str] = DEFAULT_EXTENSIONS, extension_configs: dict[str, dict] | None = None,
+                 workers: int | None = None, **kwargs):
+        self.extensions = tuple(map(extension_name, extensions))
+        self.extension_configs = {extension_name(name): config for name, config in (extension_configs or {}).items()}
+        self.kwargs = kwargs
+        self.workers = workers or os.cpu_count() or 1
+        self._local = threading.local()
+        self._renderers = [] # All of them, to close them
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def render(self, text: str) -> str:
+        renderer = getattr(self._local, "renderer", None)
+        if renderer is None:
+            renderer = self._local.renderer = Renderer(self.extensions, self.extension_configs, **self.kwargs)
+            with self._lock:
+                self._renderers.append(renderer)
+        return renderer.render(text)
+
+    def render_many(self, texts: Iterable[str], stats: RenderStats | None = None) -> Iterator[str]:
+        """ Render texts in the pool of threads, and yield their HTML in the same order
+        Like render_files, only a few documents per thread are waiting at once, so texts can be a lazy iterator """
+        with self._lock:
+            if self._executor is None:
+                # Only imported here, since it takes longer to import than the rest of the package
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="kdlf-render")
+        start = time.perf_counter()
+        texts = iter(texts)
+        pending = deque(self._executor.submit(self.render, text) for text in islice(texts, self.workers * 2))
+        while pending:
+            html = pending.popleft().result()
+            for text in islice(texts, 1):
+                pending.append(self._executor.submit(self.render, text))
+            if stats is not None:
+                stats.pages += 1
+                stats.seconds = time.perf_counter() - start
+            yield html
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            for renderer in self._renderers:
+                renderer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Each worker process creates its Renderer once when it starts, and uses it for all the files it's given
+_worker_renderer = None
+
+def _init_worker(extensions: tuple[str, ...], extension_configs: dict[str, dict], kwargs: dict) -> None:
+    global _worker_renderer
+    _worker_renderer = Renderer(extensions, extension_configs, **kwargs)
+
+def _render_chunk(paths: list[str | os.PathLike]) -> list[tuple[str | os.PathLike, str]]:
+    return [(path, _worker_renderer.render_file(path)) for path in paths]
+
+
+def render_files(paths: Iterable[str | os.PathLike], extensions: Iterable[str] = DEFAULT_EXTENSIONS,
+                 extension_configs: dict[str, dict] | None = None, workers: int | None = None, chunk_size: int = 16,
+                 ordered: bool = True, stats: RenderStats | None = None, **kwargs) -> Iterator[tuple[str | os.PathLike, str]]:
+    """ Render the files at paths in a pool of worker processes, and yield (path, html) for each of them
+    The files are read as UTF-8, and sent to the workers chunk_size at a time, with only a few chunks waiting at once
+    (so paths can be a lazy iterator of any length)
+    If ordered is False, the results are yielded as soon as they're ready, instead of in the same order as paths
+    If stats is given, it's updated with the number of pages and the time taken as the results come in
+
+    The extensions and configs are sent to the workers, so they must be picklable (the names in EXTENSIONS and plain dicts are)"""
+    # Only imported here, since it takes longer to import than the rest of the package
+    from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    paths = iter(paths)
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(tuple(extensions), extension_configs or {}, kwargs)) as executor:
+        def _submit() -> bool:
+            chunk = list(islice(paths, chunk_size))
+            if chunk:
+                pending.append(executor.submit(_render_chunk, chunk))
+            return bool(chunk)
+
+        def _results(chunk_results: list[tuple[str | os.PathLike, str]]) -> Iterator[tuple[str | os.PathLike, str]]:
+            if stats is not None:
+                stats.pages += len(chunk_results)
+                stats.seconds = time.perf_counter() - start
+            yield from chunk_results
+
+        # Keep two chunks per worker in flight, so none of them sits idle while the results are handled
+        pending = deque()
+        exhausted = False
+        while len(pending) < workers * 2 and not exhausted:
+            exhausted = not _submit()
+
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+            for future in done:
+                if not exhausted:
+                    exhausted = not _submit()
+                yield from _results(future.result())
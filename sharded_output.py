@@ -0,0 +1,205 @@
+from markdown.treeprocessors import Treeprocessor
+from markdown.extensions import Extension
+from markdown.extensions.toc import slugify_unicode
+from markdown import Markdown
+from typing import Iterable, Iterator, NamedTuple
+import xml.etree.ElementTree as etree
+import hashlib
+import html
+import json
+import os
+import re
+
+from .rendering import DEFAULT_EXTENSIONS, Renderer
+
+MANIFEST_VERSION = 1
+INDEX_NAME = "index.html"
+MANIFEST_NAME = "manifest.json"
+
+_RE_SECTION_CLASS = re.compile(r'section-level-(\d+)')
+# Placeholders of the htmlStash (eg: raw HTML in a header), which aren't part of the title
+_RE_PLACEHOLDER = re.compile(r'\x02[^\x03]*\x03')
+_RE_UNSAFE_NAME = re.compile(r'[^\w-]')
+
+
+class SectionFragment(NamedTuple):
+    """A section of the document, rendered on its own"""
+    id: str # Stable id of the section, made from its header (the same as the id of its header, if it has one)
+    title: str # Text of its header
+    level: int
+    file: str # Path of its HTML file, relative to the index page
+    html: str # The whole <section>, with its header
+
+
+class ShardedSectionsTreeprocessor(Treeprocessor):
+    """Takes the <section>s of level `level` created by SectionsViaHeaders out of the document, renders each of them to
+    its own HTML fragment (in md.section_fragments), and leaves only a stub with their header in the document, with
+    a data-fragment attribute with the path of the fragment, so the page can load it when it's needed
+    With level 0, it's the sections at the top of the document, whatever their level
+
+    Runs after all the other treeprocessors, and the fragments go through the postprocessors like the document does
+    (the htmlStash is the same for the whole document, so raw HTML ends up in the fragment it was in)
+    Postprocessors that do something once per document (eg: write stats) can have a run_fragment(text) method,
+    which is used for the fragments instead of run"""
+    def __init__(self, md: Markdown, level: int, fragments_dir: str):
+        super().__init__(md)
+        self.level = level
+        self.fragments_dir = fragments_dir.rstrip("/")
+
+    def run(self, root):
+        used_ids = set()
+        fragments = []
+        for parent, index, section, level in list(self._find_sections(root, self.level == 0)):
+            header = section[0] if len(section) and section[0].tag == f"h{level}" else None
+            title = html.unescape(_RE_PLACEHOLDER.sub("", "".join(header.itertext()))).strip() if header is not None else ""
+            section_id = self._section_id(header, title, len(fragments), used_ids)
+            if header is None or header.get("id") != section_id:
+                section.set("id", section_id)
+            # Ids given to the header (eg: with attr_list) can have anything in them
+            name = _RE_UNSAFE_NAME.sub("-", section_id) + ".html"
+            file = f"{self.fragments_dir}/{name}" if self.fragments_dir else name
+            fragments.append(SectionFragment(section_id, title, level, file, self._render_fragment(section)))
+
+            # The stub keeps the header, so the index page has all of them
+            stub = etree.Element("section", section.attrib)
+            stub.set("data-fragment", file)
+            if header is not None:
+                stub.append(header)
+            stub.text = section.text
+            stub.tail = section.tail
+            parent[index] = stub
+        self.md.section_fragments = fragments
+
+    def _find_sections(self, parent: etree.Element, top: bool) -> Iterator[tuple[etree.Element, int, etree.Element, int]]:
+        """ Yield the sections to take out as (parent, index in it, section, level), in document order """
+        for index, child in enumerate(parent):
+            result = _RE_SECTION_CLASS.fullmatch(child.get("class", "")) if child.tag == "section" else None
+            if result is not None and (top or int(result.group(1)) == self.level):
+                yield parent, index, child, int(result.group(1))
+            elif not top:
+                # A section of another level (or anything else) can have the ones of the right level inside
+                yield from self._find_sections(child, top)
+
+    def _section_id(self, header: etree.Element | None, title: str, position: int, used_ids: set[str]) -> str:
+        """ Get an id for the section that stays the same as long as its header does (the ones with the same header
+        are told apart by a number, in order) """
+        base = header.get("id") if header is not None else None
+        base = base or slugify_unicode(title, "-") or f"section-{position + 1}"
+        section_id = base
+        number = 2
+        while section_id in used_ids:
+            section_id = f"{base}-{number}"
+            number += 1
+        used_ids.add(section_id)
+        return section_id
+
+    def _render_fragment(self, section: etree.Element) -> str:
+        """ Serialize a section like Markdown.convert does with the whole document """
+        tail, section.tail = section.tail, None
+        try:
+            output = self.md.serializer(section)
+        finally:
+            section.tail = tail
+        for processor in self.md.postprocessors:
+            output = getattr(processor, "run_fragment", processor.run)(output)
+        return output.strip()
+
+
+class ShardedSectionsExtension(Extension):
+    """Extension to render the sections created by SectionsViaHeadersExtension as separate HTML fragments, so huge
+    documents can be sent as a small page with only the headers, and each section loaded when it's needed
+    (see ShardedRenderer to write them to files)
+    The fragments are in md.section_fragments after each document (see SectionFragment), and each section in the
+    document is replaced by a stub with its header, and a data-fragment attribute with the path of its fragment:
+    <section class="section-level-1" id="intro" data-fragment="sections/intro.html"><h1>Intro</h1></section>
+
+    Takes these config options:
+    'level' (default: 0) level of the sections to take out (their headers' number of #s), 0 for the ones at the
+        top of the document, the sections of other levels stay in the page (or in the fragment they're in)
+    'fragments_dir' (default: 'sections') directory of the fragments, relative to the page"""
+    def extendMarkdown(self, md):
+        md.registerExtension(self)
+        self.md = md
+        md.section_fragments = []
+        # After unescape (0), so the fragments are the same as the rest of the document would be
+        md.treeprocessors.register(ShardedSectionsTreeprocessor(md, self.getConfig("level"), self.getConfig("fragments_dir")),
+                                   "sharded_sections", -10)
+
+    def reset(self):
+        self.md.section_fragments = []
+
+    def __init__(self, **kwargs):
+        self.config = {
+            "level": [0, "Level of the sections to render separately (0 for the top level ones)"],
+            "fragments_dir": ["sections", "Directory of the fragments, relative to the page"],
+        }
+        super(ShardedSectionsExtension, self).__init__(**kwargs)
+
+
+class ShardedRenderer(Renderer):
+    """Renderer that writes each document as a page with only the headers of its sections (index.html), an HTML file
+    for each section, and a JSON manifest (manifest.json) with the size and hash of each of them:
+    {"version": 1, "index": {"file": "index.html", "bytes": 1234},
+     "sections": [{"id": "intro", "title": "Intro", "level": 1, "file": "sections/intro.html", "bytes": 5678, "hash": "..."}]}
+    The hash is of the content of the fragment, so a client can tell which ones it already has
+
+    ShardedSectionsExtension is added to the extensions, level and fragments_dir are its options"""
+    def __init__(self, extensions: Iterable[str] = DEFAULT_EXTENSIONS, extension_configs: dict[str, dict] | None = None,
+                 level: int = 0, fragments_dir: str = "sections", **kwargs):
+        extension_configs = dict(extension_configs or {})
+        extension_configs["sharded_sections"] = {"level": level, "fragments_dir": fragments_dir}
+        super().__init__((*extensions, "sharded_sections"), extension_configs, **kwargs)
+
+    def render_sharded(self, text: str) -> tuple[str, list[SectionFragment]]:
+        """ Convert text to the HTML of the page, and the fragments of its sections """
+        try:
+            output = self.md.convert(text)
+            return output, self.md.section_fragments
+        finally:
+            self.md.reset()
+
+    def write(self, text: str, output_dir: str | os.PathLike) -> dict:
+        """ Render text, and write the page, the fragments and the manifest to output_dir, returns the manifest
+        The fragments written for the previous version of the page that aren't used anymore are deleted """
+        output, fragments = self.render_sharded(text)
+        output_dir = os.path.abspath(output_dir)
+        old_files = {section["file"] for section in _read_manifest(output_dir).get("sections", [])}
+
+        sections = []
+        for fragment in fragments:
+            data = fragment.html.encode("utf-8")
+            _write(os.path.join(output_dir, fragment.file), data)
+            sections.append({"id": fragment.id, "title": fragment.title, "level": fragment.level, "file": fragment.file,
+                             "bytes": len(data), "hash": hashlib.blake2b(data, digest_size=16).hexdigest()})
+        data = output.encode("utf-8")
+        _write(os.path.join(output_dir, INDEX_NAME), data)
+        manifest = {"version": MANIFEST_VERSION, "index": {"file": INDEX_NAME, "bytes": len(data)}, "sections": sections}
+        _write(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8"))
+
+        for file in old_files - {fragment.file for fragment in fragments}:
+            try:
+                os.unlink(os.path.join(output_dir, file))
+            except OSError:
+                pass
+        return manifest
+
+    def write_file(self, path: str | os.PathLike, output_dir: str | os.PathLike) -> dict:
+        with open(path, encoding="utf-8") as f:
+            return self.write(f.read(), output_dir)
+
+
+def _read_manifest(output_dir: str) -> dict:
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) and manifest.get("version") == MANIFEST_VERSION else {}
+
+def _write(path: str, data: bytes) -> None:
+    # Written to another file first, so a client never gets half of one
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
@@ -1,10 +1,26 @@
 from markdown.inlinepatterns import LinkInlineProcessor
+from markdown.postprocessors import Postprocessor
 from markdown.extensions import Extension
+from markdown import Markdown
 import xml.etree.ElementTree as etree
+import html
+import os
 import re
 
-class SmallImageProcessor(LinkInlineProcessor):
+from .trigger_prescan_extension import SkippableInlineProcessor
+from .image_manifest import get_manifest, local_path, register_image_loading, set_image_attributes
+
+class SmallImageProcessor(SkippableInlineProcessor, LinkInlineProcessor):
     DIV_CLASS = "small-img"
+    TRIGGER = "small_image"
+
+    # thumbnails is a ThumbnailGenerator, if the images should show a thumbnail instead of the full image
+    # manifest is an ImageManifest, if the images should get their size (the files are in images_dir)
+    def __init__(self, pattern: str, md: Markdown, thumbnails=None, manifest=None, images_dir: str = "."):
+        super().__init__(pattern, md)
+        self.thumbnails = thumbnails
+        self.manifest = manifest
+        self.images_dir = os.path.abspath(images_dir)
 
     # Adapted from markdown.inlinepatterns.ImageProcessor
     def handleMatch(self, m: re.Match[str], data: str) -> tuple[etree.Element | None, int | None, int | None]:
@@ -18,9 +34,22 @@ class SmallImageProcessor(LinkInlineProcessor):
             return None, None, None
 
         e = etree.Element("a")
-        el = etree.SubElement(e, "img")
+        thumbnail = self.thumbnails.thumbnail(src) if self.thumbnails is not None else None
+        if thumbnail is None:
+            el = etree.SubElement(e, "img")
+            el.set("src", src)
+        else:
+            # The link still goes to the full image
+            parent = e
+            if thumbnail.sources:
+                # The variants in other formats, for the browsers that support them
+                parent = etree.SubElement(e, "picture")
+                for mime_type, srcset in thumbnail.sources:
+                    etree.SubElement(parent, "source", {"type": mime_type, "srcset": srcset})
+            el = etree.SubElement(parent, "img")
+            el.set("src", thumbnail.src)
+            el.set("srcset", thumbnail.srcset)
 
-        el.set("src", src)
         e.set("href", src)
         e.set("target", "_blank")
         el.set("class", self.DIV_CLASS)
@@ -29,13 +58,101 @@ class SmallImageProcessor(LinkInlineProcessor):
             el.set("title", title)
 
         el.set('alt', self.unescape(text))
+        if self.manifest is not None:
+            set_image_attributes(el, self._size(src, thumbnail))
         return e, m.start(0), index
 
+    def _size(self, src: str, thumbnail) -> tuple[int, int] | None:
+        path = local_path(self.images_dir, src)
+        size = self.manifest.size(path) if path is not None else None
+        if size is None or thumbnail is None:
+            return size
+        # The size of the thumbnail: scaled down to its width, never up (like ThumbnailGenerator does)
+        width, height = size
+        if width <= self.thumbnails.width:
+            return size
+        return self.thumbnails.width, max(1, round(height * self.thumbnails.width / width))
+
+
+class SmallImageThumbnailsPostprocessor(Postprocessor):
+    """ Waits for the thumbnails of the document to be made, and puts back the full image where one couldn't be
+    The fragments of ShardedSectionsExtension need it too: only the first one waits, the others just replace the URLs """
+    def __init__(self, md: Markdown, thumbnails):
+        super().__init__(md)
+        self.thumbnails = thumbnails
+
+    def run(self, text):
+        for url, src in self.thumbnails.wait().items():
+            # Escaped the same way as the attributes by the serializer
+            text = text.replace(_escape_attribute(url), _escape_attribute(src))
+        return text
+
+def _escape_attribute(value: str) -> str:
+    return html.escape(value, quote=False).replace('"', "&quot;").replace("\n", "&#10;")
+
+
 class SmallImageExtension(Extension):
-    """Extension to insert small, clickable image previews"""
+    """Extension to insert small, clickable image previews
+
+    Takes these config options, to show thumbnails instead of the full images (which need Pillow, see ThumbnailGenerator):
+    'thumbnails_dir' (default: '') directory to put the thumbnails in, if not set the images are shown as they are
+    'thumbnails_url' (default: '') URL of thumbnails_dir, for the src of the images
+    'images_dir' (default: '.') directory the src of the images are relative to (also the ones starting with /)
+    'thumbnail_width' (default: 320) width of the thumbnails (a thumbnail twice as wide is made too, for srcset)
+    'thumbnail_formats' (default: []) other formats to make the thumbnails in too, eg: ['avif', 'webp'] (the images
+        are put in a <picture>, with a <source> for each format, in this order)
+    'thumbnail_workers' (default: 0) number of processes to make the thumbnails with (0 for one per CPU)
+
+    And these ones, to give the images their size (read from the files in images_dir, see ImageManifest):
+    'image_sizes' (default: False) sets the width and height of the images (of the thumbnails if there are),
+        and makes them load lazily, apart from the first eager_images of the document
+    'image_manifest' (default: '') JSON file to keep the sizes in, so they're only read from the images once
+    'eager_images' (default: 2) number of images at the start of the document that are loaded right away
+
+    The link still goes to the full image. The thumbnails are made while the document is being converted, and it's
+    only returned once they're done; images that aren't local files, or that couldn't be made into thumbnails,
+    are shown as they are
+    The processes making the thumbnails are stopped by close() (see Renderer.close)"""
     def extendMarkdown(self, md):
         SMALL_IMAGE_PATTERN = r'!!\['
 
         md.registerExtension(self)
         self.md = md
-        md.inlinePatterns.register(SmallImageProcessor(SMALL_IMAGE_PATTERN, md), "small_image", 175) # !Priority higher than the stock image parser
+        self.thumbnails = None
+        if self.getConfig("thumbnails_dir"):
+            # Only imported when it's used, since it's not needed otherwise
+            from .thumbnails import ThumbnailGenerator
+            self.thumbnails = ThumbnailGenerator(self.getConfig("images_dir"), self.getConfig("thumbnails_dir"),
+                                                 self.getConfig("thumbnails_url"), self.getConfig("thumbnail_width"),
+                                                 self.getConfig("thumbnail_formats"), self.getConfig("thumbnail_workers"))
+            md.postprocessors.register(SmallImageThumbnailsPostprocessor(md, self.thumbnails), "small_image_thumbnails", 5)
+        manifest = None
+        if self.getConfig("image_sizes"):
+            manifest = get_manifest(self.getConfig("image_manifest"))
+            register_image_loading(md, manifest, self.getConfig("eager_images"))
+        md.inlinePatterns.register(SmallImageProcessor(SMALL_IMAGE_PATTERN, md, self.thumbnails, manifest,
+                                                       self.getConfig("images_dir")), "small_image", 175) # !Priority higher than the stock image parser
+
+    def close(self) -> None:
+        """ Stop the processes making the thumbnails (called by Renderer.close) """
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+
+    def __init__(self, **kwargs):
+        self.config = {
+            "thumbnails_dir": ["", "Directory to put the thumbnails in (empty to show the full images)"],
+            "thumbnails_url": ["", "URL of the thumbnails directory"],
+            "images_dir": [".", "Directory the src of the images are relative to"],
+            "thumbnail_width": [320, "Width of the thumbnails"],
+            "thumbnail_formats": [[], "Other formats to make the thumbnails in too (avif, webp)"],
+            "thumbnail_workers": [0, "Number of processes to make the thumbnails with (0 for one per CPU)"],
+            "image_sizes": [False, "Set the width and height of the images, and load them lazily"],
+            "image_manifest": ["", "JSON file to keep the sizes of the images in"],
+            "eager_images": [2, "Number of images at the start of the document to load right away"],
+        }
+        super(SmallImageExtension, self).__init__(**kwargs)
+
+
+def makeExtension(**kwargs):
+    """ Lets Markdown load the extension by the name of this module """
+    return SmallImageExtension(**kwargs)
@@ -0,0 +1,153 @@
+from typing import NamedTuple, Sequence
+import hashlib
+import os
+
+from .image_manifest import local_path
+
+# Pillow is only needed to make the thumbnails, and only imported when a ThumbnailGenerator is created
+PILLOW_MISSING = "Thumbnails need Pillow (pip install Pillow)"
+
+# Extensions and MIME types of the formats the variants can be made in
+FORMATS = {
+    "webp": (".webp", "image/webp"),
+    "avif": (".avif", "image/avif"),
+}
+_HASH_SIZE = 16 # Bytes of the hash of the image in the names of its thumbnails
+_READ_SIZE = 1024 * 1024
+
+
+class Thumbnail(NamedTuple):
+    """The URLs of the thumbnails of an image"""
+    src: str # Same format as the image, thumbnail width
+    srcset: str # Same format, 1x and 2x
+    sources: tuple[tuple[str, str], ...] # (MIME type, srcset) of the variants in other formats
+
+
+def _make_thumbnails(source: str, outputs: Sequence[tuple[str, int, str | None]]) -> list[str]:
+    """ Make the thumbnails of the image at source, given as (path, width, format or None for the same as the image)
+    Runs in the worker processes, returns the paths that couldn't be made """
+    from PIL import Image, ImageOps
+
+    failed = []
+    try:
+        image = Image.open(source)
+        image.load()
+        source_format = image.format
+        # Turned the way the EXIF orientation says, since save() doesn't keep it (and it's what image_size reports)
+        image = ImageOps.exif_transpose(image)
+    except OSError:
+        return [path for path, _, _ in outputs]
+    for path, width, image_format in outputs:
+        try:
+            thumbnail = image.copy()
+            # Keeps the aspect ratio, and never makes the image bigger
+            thumbnail.thumbnail((width, width * 16))
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            thumbnail.save(temp_path, format=image_format or source_format)
+            os.replace(temp_path, path)
+        except (OSError, ValueError, KeyError):
+            failed.append(path)
+    return failed
+
+
+class ThumbnailGenerator:
+    """Makes downscaled copies of images in output_dir, in a pool of worker processes
+    Thumbnails are named after a hash of the content of the image, so the ones of images that didn't change since
+    they were made are never made again (and a changed image doesn't get the old thumbnail from the browser's cache)
+
+    thumbnail() gives the URLs of the thumbnails of an image right away, and starts making them in the background,
+    wait() waits until they're done and tells which ones failed (eg: the file isn't an image)"""
+    def __init__(self, images_dir: str | os.PathLike, output_dir: str | os.PathLike, output_url: str, width: int = 320,
+                 formats: Sequence[str] = (), workers: int | None = None):
+        try:
+            import PIL # noqa: F401 (Only checking it's there, the workers import what they need)
+        except ImportError as e:
+            raise ImportError(PILLOW_MISSING) from e
+        for image_format in formats:
+            if image_format not in FORMATS:
+                raise ValueError(f"Unknown thumbnail format: {image_format} (must be one of {', '.join(FORMATS)})")
+        self.images_dir = os.path.abspath(images_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.output_url = output_url if output_url.endswith("/") else output_url + "/"
+        self.width = width
+        self.formats = tuple(formats)
+        self.workers = workers or os.cpu_count() or 1
+        self._hashes = {} # {path: ((mtime, size), hash)}, so images are only read again when they change
+        self._pending = {} # {future: {thumbnail path: original src}}
+        self._in_progress = set() # Thumbnail paths of the pending futures, so they're not made twice at once
+        self._executor = None
+        # {URL: original src} of all the thumbnails that couldn't be made, kept since the HTML of a table cell
+        # can be reused in later documents (see memoize_cells in ExtendedTableExtension)
+        self.failed = {}
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def thumbnail(self, src: str) -> Thumbnail | None:
+        """ Get the thumbnails of the image at src (relative to images_dir), and start making the ones that don't exist
+        None if src isn't a local file """
+        path = local_path(self.images_dir, src)
+        if path is None:
+            return None
+        digest = self._hash(path)
+        if digest is None:
+            return None
+        base, extension = os.path.splitext(os.path.basename(path))
+        # The name of the image is kept only to make them easier to recognize
+        names = {}
+        for width in (self.width, self.width * 2):
+            names[width, None] = f"{base}-{digest}-{width}{extension.lower()}"
+            for image_format in self.formats:
+                names[width, image_format] = f"{base}-{digest}-{width}{FORMATS[image_format][0]}"
+
+        missing = [(os.path.join(self.output_dir, name), width, image_format)
+                   for (width, image_format), name in names.items()
+                   if os.path.join(self.output_dir, name) not in self._in_progress
+                   and not os.path.exists(os.path.join(self.output_dir, name))]
+        if missing:
+            if self._executor is None:
+                # Only imported here, since it takes longer to import than the rest of the package
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(self.workers)
+            future = self._executor.submit(_make_thumbnails, path, missing)
+            self._pending[future] = {output_path: src for output_path, _, _ in missing}
+            self._in_progress.update(self._pending[future])
+
+        def _srcset(image_format: str | None) -> str:
+            return (f"{self.output_url}{names[self.width, image_format]} 1x, "
+                    f"{self.output_url}{names[self.width * 2, image_format]} 2x")
+        return Thumbnail(self.output_url + names[self.width, None], _srcset(None),
+                         tuple((FORMATS[image_format][1], _srcset(image_format)) for image_format in self.formats))
+
+    def wait(self) -> dict[str, str]:
+        """ Wait for all the thumbnails that are being made, and get the ones that failed (so far) as {URL: original src} """
+        failed = self.failed
+        pending, self._pending = self._pending, {}
+        self._in_progress = set()
+        for future, srcs in pending.items():
+            try:
+                failed_paths = future.result()
+            except Exception:
+                failed_paths = list(srcs)
+            for path in failed_paths:
+                failed[self.output_url + os.path.basename(path)] = srcs[path]
+        return failed
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _hash(self, path: str) -> str | None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        digest = hashlib.blake2b(digest_size=_HASH_SIZE)
+        with open(path, "rb") as f:
+            while chunk := f.read(_READ_SIZE):
+                digest.update(chunk)
+        self._hashes[path] = (key, digest.hexdigest())
+        return self._hashes[path][1]
@@ -0,0 +1,81 @@
+from markdown.extensions import Extension
+from markdown.preprocessors import Preprocessor
+from markdown import Markdown
+import re
+
+# For each processor: the registry it's in, and the strings of which at least one must be in the document for it to match
+TRIGGERS = {
+    "ps2_buttons": ("inlinePatterns", ("@@",)),
+    "small_image": ("inlinePatterns", ("!![",)),
+    "link_blank": ("inlinePatterns", ("?[",)),
+    "warning_highlight": ("inlinePatterns", ("*!",)),
+    "text_highlight": ("inlinePatterns", ("!*",)), # Starts with *<number>!, but always ends with !*
+    "unsure_highlight": ("inlinePatterns", ("*?",)),
+    "header-sections": ("blockprocessors", ("# ",)), # Not only at the start of lines, headers can be in blockquotes
+    "extended_table": ("blockprocessors", ("|",)), # It handles all tables, not just the ones with !{
+}
+
+
+class TriggerPrescanPreprocessor(Preprocessor):
+    """ Search the document once for the strings each kdlf processor needs to match anything,
+    and store the names of the ones that can't match in md.skipped_processors (until the next document, or reset) """
+    def run(self, lines):
+        text = "\n".join(lines)
+        # Raw HTML has already been stashed away, but md_in_html could still parse the Markdown inside it
+        for block in self.md.htmlStash.rawHtmlBlocks:
+            text += "\n" + (block if isinstance(block, str) else "".join(block.itertext()))
+
+        self.md.skipped_processors = [name for name, (registry_name, triggers) in TRIGGERS.items()
+                                      if name in self._get_registry(registry_name)
+                                      and not any(trigger in text for trigger in triggers)]
+        return lines
+
+    def _get_registry(self, registry_name: str):
+        if registry_name == "blockprocessors":
+            return self.md.parser.blockprocessors
+        return getattr(self.md, registry_name)
+
+
+def is_skipped(md: Markdown, name: str) -> bool:
+    """ Whether TriggerPrescanExtension found that the processor registered as name has nothing to match in the document
+    being converted (always False without the extension) """
+    return name in getattr(md, "skipped_processors", ())
+
+
+class SkippableInlineProcessor:
+    """Mixin for the kdlf inline processors: in the documents where TriggerPrescanExtension found that their syntax
+    isn't there, their regex is swapped for one that fails right away, so Markdown doesn't search the text for it
+    TRIGGER is the name they're registered with (see TRIGGERS)"""
+    TRIGGER = ""
+
+    def getCompiledRegExp(self):
+        if is_skipped(self.md, self.TRIGGER):
+            return _NEVER_MATCHES
+        return self.compiled_re
+
+# Anchored to the start, so it's only tried once wherever the search starts (unlike eg: (?!), tried at every position)
+_NEVER_MATCHES = re.compile(r'\A(?!)')
+
+
+class TriggerPrescanExtension(Extension):
+    """Extension that skips the kdlf processors which can't match anything in a document
+    Before the document is parsed, it's searched once for the strings each syntax starts with (@@, !![, ?[, *!, *?, |, # ...),
+    and the names of the processors of the syntaxes that aren't there are stored in md.skipped_processors (also to see
+    what each page saved)
+    The registries are never changed: the processors check md.skipped_processors themselves (the inline ones don't
+    search the text, see SkippableInlineProcessor, and the block ones don't test the blocks), so it's only the state
+    of the document being converted"""
+    def extendMarkdown(self, md):
+        md.registerExtension(self)
+        self.md = md
+        md.skipped_processors = []
+        # After the other preprocessors, so the text they added is searched too
+        md.preprocessors.register(TriggerPrescanPreprocessor(md), "trigger_prescan", 5)
+
+    def reset(self):
+        self.md.skipped_processors = []
+
+
+def makeExtension(**kwargs):
+    """ Lets Markdown load the extension by the name of this module """
+    return TriggerPrescanExtension(**kwargs)
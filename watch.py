@@ -0,0 +1,191 @@
+from typing import Iterable
+from urllib.parse import unquote, urlsplit
+import argparse
+import json
+import os
+import sys
+import time
+
+from .image_manifest import image_urls
+from .rendering import DEFAULT_EXTENSIONS, Renderer
+
+SOURCE_SUFFIX = ".md"
+
+
+class SiteBuilder:
+    """Renders a directory of Markdown files to HTML files with the same relative paths, and keeps track of what each
+    page depends on, so only the pages that need it are rendered again when something changes
+    A page depends on its source and on the images it shows: the src of the imgs in its HTML, and the full images the
+    thumbnails of SmallImageExtension link to (see image_urls), as files relative to the page, or to static_dir for
+    the ones starting with / (eg: the imgs_path of PS2ButtonsExtension); images on other sites are ignored
+
+    The same Renderer is used for all the pages, so the extensions are only loaded once, call close() when done"""
+    def __init__(self, content_dir: str | os.PathLike, output_dir: str | os.PathLike, extensions: Iterable[str] = DEFAULT_EXTENSIONS,
+                 extension_configs: dict[str, dict] | None = None, static_dir: str | os.PathLike | None = None, **kwargs):
+        self.content_dir = os.path.abspath(content_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.static_dir = os.path.abspath(static_dir) if static_dir is not None else self.content_dir
+        self.renderer = Renderer(extensions, extension_configs, **kwargs)
+        self.sources = {} # {source: (mtime, size)} of the pages
+        self.assets = {} # {asset: (mtime, size) or None if it doesn't exist} of the files the pages depend on
+        self.dependencies = {} # {source: set of assets}
+        self.dependents = {} # {asset: set of sources}
+        self.errors = {} # {source: exception} of the pages that failed to render the last time they were tried
+
+    def build(self) -> tuple[list[str], float]:
+        """ Render all the pages, returns them and how long it took """
+        self.sources = self._scan_sources()
+        return self._render(sorted(self.sources))
+
+    def update(self) -> tuple[list[str], float]:
+        """ Render again the pages whose source or images changed since the last time, and delete the HTML of the pages
+        whose source was deleted, returns the pages that were rendered and how long it took """
+        sources = self._scan_sources()
+        changed = {source for source, stat in sources.items() if self.sources.get(source) != stat}
+        for source in self.sources.keys() - sources.keys():
+            self._remove(source)
+        self.sources = sources
+        for asset, stat in list(self.assets.items()):
+            new_stat = _stat(asset)
+            if new_stat != stat:
+                self.assets[asset] = new_stat
+                changed.update(source for source in self.dependents[asset] if source in sources)
+        return self._render(sorted(changed))
+
+    def close(self) -> None:
+        self.renderer.close()
+
+    def output_path(self, source: str) -> str:
+        relative = os.path.relpath(source, self.content_dir)
+        return os.path.join(self.output_dir, os.path.splitext(relative)[0] + ".html")
+
+    def _render(self, sources: list[str]) -> tuple[list[str], float]:
+        start = time.perf_counter()
+        for source in sources:
+            try:
+                output = self.renderer.render_file(source)
+            except Exception as e:
+                # The last HTML that was rendered is kept, and the page is tried again when it changes
+                self.errors[source] = e
+                continue
+            self.errors.pop(source, None)
+            path = self.output_path(source)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(output)
+            self._set_dependencies(source, {self._asset_path(source, url) for url in image_urls(output)} - {None})
+        return sources, time.perf_counter() - start
+
+    def _remove(self, source: str) -> None:
+        self._set_dependencies(source, set())
+        self.errors.pop(source, None)
+        try:
+            os.unlink(self.output_path(source))
+        except FileNotFoundError:
+            pass
+
+    def _set_dependencies(self, source: str, assets: set[str]) -> None:
+        old_assets = self.dependencies.get(source, set())
+        for asset in old_assets - assets:
+            self.dependents[asset].discard(source)
+            if not self.dependents[asset]:
+                del self.dependents[asset]
+                del self.assets[asset]
+        for asset in assets - old_assets:
+            if asset not in self.dependents:
+                self.dependents[asset] = set()
+                self.assets[asset] = _stat(asset)
+            self.dependents[asset].add(source)
+        if assets:
+            self.dependencies[source] = assets
+        else:
+            self.dependencies.pop(source, None)
+
+    def _asset_path(self, source: str, src: str) -> str | None:
+        """ Get the file an img src points to, or None if it's not a local file """
+        url = urlsplit(src)
+        if url.scheme or url.netloc or not url.path:
+            return None
+        path = unquote(url.path)
+        if path.startswith("/"):
+            return os.path.normpath(os.path.join(self.static_dir, path.lstrip("/")))
+        return os.path.normpath(os.path.join(os.path.dirname(source), path))
+
+    def _scan_sources(self) -> dict[str, tuple[int, int]]:
+        sources = {}
+        for root, _, files in os.walk(self.content_dir):
+            for name in files:
+                if name.endswith(SOURCE_SUFFIX):
+                    path = os.path.join(root, name)
+                    stat = _stat(path)
+                    if stat is not None:
+                        sources[path] = stat
+        return sources
+
+
+def _stat(path: str) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def watch(builder: SiteBuilder, interval: float = 0.5, log=print) -> None:
+    """ Build the site, then check for changes every interval seconds and rebuild what's needed, until interrupted
+    Polling is used (instead of eg: inotify) so it works the same everywhere without any other dependency """
+    pages, seconds = builder.build()
+    log(f"Built {len(pages)} pages in {seconds * 1000:.0f}ms")
+    _log_errors(builder, pages, log)
+    while True:
+        time.sleep(interval)
+        pages, seconds = builder.update()
+        if pages:
+            names = ", ".join(os.path.relpath(page, builder.content_dir) for page in pages[:5])
+            more = f" and {len(pages) - 5} more" if len(pages) > 5 else ""
+            log(f"Rebuilt {len(pages)} pages in {seconds * 1000:.0f}ms ({names}{more})")
+            _log_errors(builder, pages, log)
+
+def _log_errors(builder: SiteBuilder, pages: list[str], log) -> None:
+    for page in pages:
+        if page in builder.errors:
+            log(f"  {os.path.relpath(page, builder.content_dir)}: {builder.errors[page]}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Render a directory of Markdown files, and render them again when they "
+                                                 "or the images they use change")
+    parser.add_argument("content_dir", help="Directory with the Markdown files (*.md)")
+    parser.add_argument("output_dir", help="Directory to write the HTML files to")
+    parser.add_argument("--static", metavar="DIR", help="Directory that image paths starting with / are in "
+                                                        "(default: content_dir)")
+    parser.add_argument("--config", metavar="PATH", help="JSON file with the configs of the extensions, "
+                                                         "as {name: {option: value}}")
+    parser.add_argument("--extension", action="append", metavar="NAME",
+                        help="Extension to use instead of the default ones (can be repeated)")
+    parser.add_argument("--interval", type=float, default=0.5, help="Seconds between checks for changes")
+    parser.add_argument("--once", action="store_true", help="Build once and exit, without watching")
+    args = parser.parse_args(argv)
+
+    extension_configs = None
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            extension_configs = json.load(f)
+    builder = SiteBuilder(args.content_dir, args.output_dir, args.extension or DEFAULT_EXTENSIONS, extension_configs,
+                          args.static)
+    try:
+        if args.once:
+            pages, seconds = builder.build()
+            print(f"Built {len(pages)} pages in {seconds * 1000:.0f}ms")
+            _log_errors(builder, pages, print)
+            return 1 if builder.errors else 0
+        watch(builder, args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        builder.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())